@@ -0,0 +1,330 @@
+"""
+An open-loop load generator for the wineinfo services.
+
+Requests are sent on a fixed schedule at the target rate whether or not
+earlier ones have finished, and latency is measured from when each request
+was scheduled to be sent rather than when it actually went out. A slow
+service therefore shows up as growing latency instead of quietly lowering
+the request rate, which is what a closed loop like 04_generator.py does.
+"""
+
+import argparse
+import asyncio
+import csv
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Tuple
+
+import httpx
+
+# just a little sys.path hack to import our Backend code without making this a
+# module. in the real world, we hope you don't have to do this!
+import os
+
+sys.path.append(
+    os.path.abspath(
+        os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir)
+    )
+)
+from python_services.app.common.api import (  # noqa: E402
+    CATALOG_SERVICE,
+    PERSIST_SERVICE,
+    RECS_SERVICE,
+    SEARCH_SERVICE,
+)
+
+QUERIES = [
+    "red",
+    "white",
+    "rose",
+    "pinot noir",
+    "cabernet",
+    "chardonnay",
+    "cherry",
+    "oak vanilla",
+    "crisp citrus",
+    "france",
+    "italy",
+    "germany",
+    "greece",
+    "australia",
+    "portugal",
+]
+PERCENTILES = [50.0, 90.0, 99.0, 99.9]
+# log-linear buckets with 2^SUB_BUCKET_BITS buckets per power of two, so
+# recorded values are within 1% of the real ones, as in HdrHistogram
+SUB_BUCKET_BITS = 8
+
+
+class LatencyHistogram:
+    """Latencies recorded in microseconds into HDR-style buckets"""
+
+    def __init__(self):
+        self.counts: Counter = Counter()
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds: float):
+        value = max(int(seconds * 1_000_000), 0)
+        shift = max(value.bit_length() - SUB_BUCKET_BITS, 0)
+        self.counts[(shift, value >> shift)] += 1
+        self.total += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LatencyHistogram"):
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile: float) -> float:
+        """The highest latency in the bucket holding the percentile, in ms"""
+        if self.total == 0:
+            return 0.0
+        target = max(int(self.total * percentile / 100 + 0.5), 1)
+        seen = 0
+        for shift, sub_bucket in sorted(self.counts, key=lambda b: b[1] << b[0]):
+            seen += self.counts[(shift, sub_bucket)]
+            if seen >= target:
+                highest = ((sub_bucket + 1) << shift) - 1
+                return min(highest, self.max) / 1000
+        return self.max / 1000
+
+
+@dataclass
+class Operation:
+    name: str
+    method: str
+    url: str
+    make_request: Callable[[random.Random], Dict]
+
+
+def make_operations(args) -> Dict[str, Operation]:
+    return {
+        "search": Operation(
+            "search",
+            "GET",
+            args.search + SEARCH_SERVICE["search"]["path"],
+            lambda rng: {"query": rng.choice(QUERIES), "page": 1, "page_size": 20},
+        ),
+        "recs": Operation(
+            "recs",
+            "GET",
+            args.recs + RECS_SERVICE["get_recommendations"]["path"],
+            lambda rng: {"query": rng.choice(QUERIES), "limit": 20},
+        ),
+        "catalog": Operation(
+            "catalog",
+            "GET",
+            args.catalog + CATALOG_SERVICE["get_wine"]["path"],
+            lambda rng: {"ids": [rng.randrange(args.max_wine_id) for _ in range(20)]},
+        ),
+        "persist": Operation(
+            "persist",
+            "GET",
+            args.persist + PERSIST_SERVICE["get_cellar"]["path"],
+            lambda rng: {"user_id": rng.randrange(args.max_user_id)},
+        ),
+        "persist_add": Operation(
+            "persist_add",
+            "POST",
+            args.persist + PERSIST_SERVICE["add_to_cellar"]["path"],
+            lambda rng: {
+                "user_id": rng.randrange(args.max_user_id),
+                "wine_id": rng.randrange(args.max_wine_id),
+            },
+        ),
+    }
+
+
+def parse_mix(mix: str) -> List[Tuple[str, float]]:
+    weights = []
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights.append((name.strip(), float(weight or 1)))
+    return weights
+
+
+@dataclass
+class Recorder:
+    interval: LatencyHistogram = field(default_factory=LatencyHistogram)
+    by_operation: Dict[str, LatencyHistogram] = field(
+        default_factory=lambda: defaultdict(LatencyHistogram)
+    )
+    statuses: Dict[str, Counter] = field(default_factory=lambda: defaultdict(Counter))
+    interval_errors: int = 0
+    sent: int = 0
+    samples: Any = None
+
+    def record(self, operation: str, scheduled: float, latency: float, status):
+        if isinstance(status, int) and status < 500:
+            self.interval.record(latency)
+            self.by_operation[operation].record(latency)
+        else:
+            self.interval_errors += 1
+        self.statuses[operation][status] += 1
+        if self.samples is not None:
+            self.samples.writerow([f"{scheduled:.6f}", operation, status, latency])
+
+
+async def send(
+    client: httpx.AsyncClient,
+    operation: Operation,
+    request: Dict,
+    scheduled: float,
+    recorder: Recorder,
+):
+    try:
+        if operation.method == "GET":
+            response = await client.get(operation.url, params=request)
+        else:
+            response = await client.post(operation.url, json=request)
+        await response.aread()
+        status = response.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    except asyncio.CancelledError:
+        # still outstanding when the run ended, which is worth knowing about
+        recorder.record(
+            operation.name, scheduled, time.perf_counter() - scheduled, "unfinished"
+        )
+        raise
+    # measured from the scheduled send, so time spent waiting behind a slow
+    # request or for a free connection counts against the service
+    recorder.record(operation.name, scheduled, time.perf_counter() - scheduled, status)
+
+
+def format_percentiles(histogram: LatencyHistogram) -> str:
+    values = [f"p{p:g}={histogram.percentile(p):.1f}" for p in PERCENTILES]
+    return " ".join(values) + f" max={histogram.max / 1000:.1f}"
+
+
+async def report(recorder: Recorder, start: float, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        histogram, recorder.interval = recorder.interval, LatencyHistogram()
+        errors, recorder.interval_errors = recorder.interval_errors, 0
+        print(
+            f"t={time.perf_counter() - start:6.1f}s sent={recorder.sent} "
+            f"ok/s={histogram.total / interval:.1f} errors={errors} "
+            f"latency_ms {format_percentiles(histogram)}",
+            flush=True,
+        )
+
+
+async def generate(args, recorder: Recorder):
+    rng = random.Random(args.seed)
+    operations = make_operations(args)
+    mix = parse_mix(args.mix)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    for name in names:
+        if name not in operations:
+            sys.exit(f"unknown operation {name}, expected one of {list(operations)}")
+
+    limits = httpx.Limits(
+        max_connections=args.connections, max_keepalive_connections=args.connections
+    )
+    timeout = httpx.Timeout(args.timeout, pool=None)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        reporter = asyncio.create_task(report(recorder, start, args.interval))
+        in_flight = set()
+        scheduled = start
+        while scheduled < start + args.duration:
+            if args.poisson:
+                scheduled += rng.expovariate(args.rps)
+            else:
+                scheduled = start + recorder.sent / args.rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            operation = operations[rng.choices(names, weights)[0]]
+            task = asyncio.create_task(
+                send(
+                    client, operation, operation.make_request(rng), scheduled, recorder
+                )
+            )
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            recorder.sent += 1
+        if in_flight:
+            await asyncio.wait(in_flight, timeout=args.timeout)
+        for task in list(in_flight):
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        reporter.cancel()
+
+
+def print_summary(recorder: Recorder):
+    overall = LatencyHistogram()
+    print("\nlatency_ms by operation:")
+    for name, histogram in sorted(recorder.by_operation.items()):
+        overall.merge(histogram)
+        print(f"  {name:8} n={histogram.total} {format_percentiles(histogram)}")
+    print(f"  {'all':8} n={overall.total} {format_percentiles(overall)}")
+    print("responses by operation:")
+    for name, statuses in sorted(recorder.statuses.items()):
+        counts = ", ".join(f"{s}: {n}" for s, n in sorted(statuses.items(), key=str))
+        print(f"  {name:8} {counts}")
+
+
+def main(args):
+    recorder = Recorder()
+    samples_file = None
+    if args.samples:
+        samples_file = open(args.samples, "w", newline="")
+        recorder.samples = csv.writer(samples_file)
+        recorder.samples.writerow(["scheduled", "operation", "status", "latency"])
+    try:
+        asyncio.run(generate(args, recorder))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if samples_file is not None:
+            samples_file.close()
+    print_summary(recorder)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Send an open-loop mix of requests at a fixed rate"
+    )
+    parser.add_argument("--rps", type=float, default=50, help="Requests per second")
+    parser.add_argument(
+        "--duration", type=float, default=30, help="Duration to run in seconds"
+    )
+    parser.add_argument(
+        "--mix",
+        type=str,
+        default="search=4,recs=2,catalog=3,persist=1",
+        help="Comma separated operation=weight pairs, from search, recs, catalog, "
+        "persist (reading a cellar) and persist_add (adding to one)",
+    )
+    parser.add_argument(
+        "--poisson",
+        action="store_true",
+        help="Send with exponentially distributed gaps instead of evenly spaced",
+    )
+    parser.add_argument(
+        "--connections", type=int, default=100, help="Connections to keep open"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=10, help="Per-request timeout in seconds"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=5, help="Seconds between progress reports"
+    )
+    parser.add_argument(
+        "--samples", type=str, default=None, help="Write every sample to this CSV"
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-wine-id", type=int, default=1000)
+    parser.add_argument("--max-user-id", type=int, default=100)
+    parser.add_argument("--catalog", type=str, default="http://localhost:8001")
+    parser.add_argument("--search", type=str, default="http://localhost:8002")
+    parser.add_argument("--recs", type=str, default="http://localhost:8003")
+    parser.add_argument("--persist", type=str, default="http://localhost:8004")
+    main(parser.parse_args())
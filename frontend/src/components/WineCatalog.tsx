@@ -10,6 +10,7 @@ import {
 	addToCellar,
 	getCellarWines,
 	recommendWines,
+	recommendCellarWines,
 	removeFromCellar,
 	searchWines,
 } from "@/lib/actions/wineActions";
@@ -313,7 +314,7 @@ export default function WineCatalog({ isLoggedIn }: WineCatalogProps) {
 	};
 
 	const fetchData = async (page: number = 1) => {
-		if (activeTab === "recommendations" && !searchTerm.trim()) {
+		if (activeTab === "recommendations" && !searchTerm.trim() && !isLoggedIn) {
 			setWines([]);
 			setCurrentPage(1);
 			setTotalPages(1);
@@ -339,7 +340,10 @@ export default function WineCatalog({ isLoggedIn }: WineCatalogProps) {
 				totalPages = data.total_pages;
 				total = data.total;
 			} else if (activeTab === "recommendations") {
-				wineData = await recommendWines(searchTerm);
+				// with nothing to search for, recommend from the user's cellar
+				wineData = searchTerm.trim()
+					? await recommendWines(searchTerm)
+					: await recommendCellarWines();
 				totalPages = 1;
 				total = wineData.length;
 			} else {
@@ -13,13 +13,7 @@ export async function getCellarWines(): Promise<Wine[]> {
     if (!session?.user?.id) {
         throw new Error("User not authenticated");
     }
-    const result = await persistService.doSql<[number]>(
-        "SELECT wine_id FROM cellar WHERE user_id = ?",
-        [session.user.id],
-        options
-    );
-
-    const wineIds = result.map((row: any[]) => row[0]);
+    const wineIds = await persistService.getCellar(session.user.id, options);
     return wineIds.length > 0 ? await catalogService.getWine(wineIds, options) : [];
 }
 
@@ -29,11 +23,7 @@ export async function addToCellar(wineId: number) {
     if (!session?.user?.id) {
         throw new Error("User not authenticated");
     }
-    await persistService.doSql(
-        "INSERT INTO cellar (wine_id, user_id) VALUES (?, ?)",
-        [wineId, session.user.id],
-        options
-    );
+    await persistService.addToCellar({ user_id: session.user.id, wine_id: wineId }, options);
 }
 
 export async function removeFromCellar(wineId: number) {
@@ -42,11 +32,7 @@ export async function removeFromCellar(wineId: number) {
     if (!session?.user?.id) {
         throw new Error("User not authenticated");
     }
-    await persistService.doSql(
-        "DELETE FROM cellar WHERE wine_id = ? AND user_id = ?",
-        [wineId, session.user.id],
-        options
-    );
+    await persistService.removeFromCellar({ user_id: session.user.id, wine_id: wineId }, options);
 }
 
 export async function searchWines(params: SearchRequest): Promise<PaginatedList<Wine>> {
@@ -79,3 +65,26 @@ export async function recommendWines(query: string): Promise<Wine[]> {
     const wineIds = await recsService.getRecommendations({ query, limit: 10 }, options);
     return wineIds.length > 0 ? await catalogService.getWine(wineIds, options) : [];
 }
+
+export async function recommendCellarWines(): Promise<Wine[]> {
+    const session = await getServerSession(authOptions);
+    const options = sessionOptions(await headers(), session);
+    if (!session?.user?.id) {
+        throw new Error("User not authenticated");
+    }
+
+    let wineIds: number[];
+    try {
+        wineIds = await recsService.getCellarRecommendations(
+            { user_id: session.user.id, limit: 10 },
+            options
+        );
+    } catch (error: any) {
+        // recs serves no cellar recommendations when cellar syncing is off
+        if (error?.status === 404) {
+            return [];
+        }
+        throw error;
+    }
+    return wineIds.length > 0 ? await catalogService.getWine(wineIds, options) : [];
+}
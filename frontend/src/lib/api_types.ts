@@ -21,15 +21,28 @@ export interface PaginatedList<T> {
     page: number;
     page_size: number;
     total_pages: number;
+    next_cursor?: string | null;
 }
 
 export interface SearchRequest {
     query: string;
     page: number;
     page_size: number;
+    cursor?: string;
 }
 
 export interface RecsRequest {
     query: string;
     limit: number;
 }
+
+export interface CellarRecsRequest {
+    user_id?: number | string;
+    wine_id?: number;
+    limit: number;
+}
+
+export interface CellarRequest {
+    user_id: number | string;
+    wine_id: number;
+}
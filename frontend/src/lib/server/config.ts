@@ -4,6 +4,7 @@ interface ServiceSettings {
     recsService: string;
     persistService: string;
     useJunction: boolean;
+    requestTimeoutMs?: number;
 }
 
 export const settings: ServiceSettings = {
@@ -11,7 +12,10 @@ export const settings: ServiceSettings = {
     searchService: process.env.SEARCH_SERVICE || "http://localhost:8002",
     recsService: process.env.RECS_SERVICE || "http://localhost:8003",
     persistService: process.env.PERSIST_SERVICE || "http://localhost:8004",
-    useJunction: process.env.USE_JUNCTION === "true"
+    useJunction: process.env.USE_JUNCTION === "true",
+    requestTimeoutMs: process.env.REQUEST_TIMEOUT_MS
+        ? Number(process.env.REQUEST_TIMEOUT_MS)
+        : undefined,
 };
 
 
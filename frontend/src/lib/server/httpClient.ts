@@ -1,4 +1,5 @@
 import type { Session } from "next-auth";
+import { settings } from "./config";
 
 export interface Fetcher {
 	fetch(url: string, config: RequestInit): Promise<Response>;
@@ -7,6 +8,9 @@ export interface Fetcher {
 export interface HttpClientOptions {
 	additionalHeaders: Headers;
 	baggage: Record<string, string>;
+	// how long the caller will wait for a response. services are told when
+	// that runs out, so they can stop working on a request nobody wants
+	timeoutMs?: number;
 }
 
 export function emptyOptions(): HttpClientOptions {
@@ -28,6 +32,7 @@ export function sessionOptions(
 			"user-id": session?.user?.id || "",
 			username: session?.user?.name || "",
 		},
+		timeoutMs: settings.requestTimeoutMs,
 	};
 }
 
@@ -65,13 +70,21 @@ export class HttpClient {
 		if (method === "POST" && !headers.has("Content-Type")) {
 			headers.set("Content-Type", "application/json");
 		}
+		const baggage = { ...options.baggage };
+		if (options.timeoutMs) {
+			// services expect the deadline in seconds since the epoch
+			baggage.deadline = ((Date.now() + options.timeoutMs) / 1000).toFixed(3);
+		}
 		headers.set(
 			"baggage",
-			Object.entries(options.baggage)
+			Object.entries(baggage)
 				.map(([key, value]) => `${key}=${value}`)
 				.join(","),
 		);
 		const request: RequestInit = { method, headers };
+		if (options.timeoutMs) {
+			request.signal = AbortSignal.timeout(options.timeoutMs);
+		}
 
 		if (method === "GET" && data) {
 			const params = new URLSearchParams();
@@ -1,4 +1,4 @@
-import { Wine, PaginatedList, SearchRequest, RecsRequest } from '@/lib/api_types';
+import { Wine, PaginatedList, SearchRequest, RecsRequest, CellarRecsRequest, CellarRequest } from '@/lib/api_types';
 import { HttpClient, HttpClientOptions } from '@/lib/server/httpClient';
 import { settings } from '@/lib/server/config';
 
@@ -45,6 +45,13 @@ export class RecsService {
     ): Promise<number[]> {
         return this.client.get('/recommendations/', request, options);
     }
+
+    async getCellarRecommendations(
+        request: CellarRecsRequest,
+        options: HttpClientOptions
+    ): Promise<number[]> {
+        return this.client.get('/recommendations/cellar/', request, options);
+    }
 }
 
 export class PersistService {
@@ -58,6 +65,18 @@ export class PersistService {
     ): Promise<T[]> {
         return this.client.post('/do_sql/', { query, params }, options);
     }
+
+    async addToCellar(request: CellarRequest, options: HttpClientOptions): Promise<void> {
+        await this.client.post('/cellar/add/', request, options);
+    }
+
+    async removeFromCellar(request: CellarRequest, options: HttpClientOptions): Promise<void> {
+        await this.client.post('/cellar/remove/', request, options);
+    }
+
+    async getCellar(userId: number | string, options: HttpClientOptions): Promise<number[]> {
+        return this.client.get('/cellar/', { user_id: userId }, options);
+    }
 }
 
 export const catalogService = new CatalogService(new HttpClient(settings.catalogService, settings.useJunction));
@@ -1,14 +1,72 @@
-from typing import Annotated, List
-from fastapi import FastAPI, Query
+import zlib
+from typing import Annotated, Iterator, List
+from fastapi import Depends, FastAPI, Query
+from fastapi.responses import StreamingResponse
+from .common.artifact import install_artifact
 from .common.config import ServiceSettings
-from .common.api import PaginatedList, Wine, CATALOG_SERVICE
+from .common.api import (
+    BrowseWinesRequest,
+    ExportWinesRequest,
+    GetAllWinesPaginatedRequest,
+    PaginatedList,
+    Wine,
+    CATALOG_SERVICE,
+)
 from .common.baggage import create_baggage_middleware
+from .common.compression import create_compression_middleware
+from .common.deadline import create_deadline_middleware
+from .common.metrics import METRICS_PATH, create_metrics_middleware, metrics_endpoint
+from .common.profiling import (
+    PROFILE_PATH,
+    SamplingProfiler,
+    create_profile_download_endpoint,
+    create_profile_endpoint,
+    create_profiling_middleware,
+)
+from .common.tracing import (
+    TRACES_PATH,
+    create_span_sink,
+    create_tracing_middleware,
+    get_traces,
+    tracer,
+)
+from .common.reloader import (
+    HEALTH_PATH,
+    DataReloader,
+    create_data_version_middleware,
+    create_health_endpoint,
+)
 from .services.catalog_service_impl import CatalogServiceImpl
 from typing import List
 
-impl = CatalogServiceImpl(ServiceSettings())
+settings = ServiceSettings()
+if settings.data_artifact:
+    install_artifact(settings.data_artifact, settings.data_path)
+impl = DataReloader(settings, CatalogServiceImpl)
 app = FastAPI()
 app.middleware("http")(create_baggage_middleware())
+app.middleware("http")(create_deadline_middleware())
+app.middleware("http")(
+    create_compression_middleware(
+        settings.compression_minimum_size, settings.compression_level
+    )
+)
+app.middleware("http")(create_metrics_middleware())
+app.get(METRICS_PATH)(metrics_endpoint)
+if settings.profiling_enabled:
+    profiler = SamplingProfiler(
+        settings.profile_dir, settings.profile_interval, settings.profile_max_files
+    )
+    app.middleware("http")(create_profiling_middleware(profiler))
+    app.get(PROFILE_PATH)(create_profile_endpoint(profiler))
+    app.get(PROFILE_PATH + "{name}")(create_profile_download_endpoint(profiler))
+tracer.configure(
+    "catalog", create_span_sink(settings.trace_sink, settings.trace_buffer_size)
+)
+app.middleware("http")(create_tracing_middleware())
+app.get(TRACES_PATH)(get_traces)
+app.middleware("http")(create_data_version_middleware(impl))
+app.get(HEALTH_PATH)(create_health_endpoint(impl))
 
 
 @app.get(CATALOG_SERVICE["get_wine"]["path"])
@@ -19,6 +77,46 @@ async def get_wine(
 
 @app.get(CATALOG_SERVICE["get_all_wines_paginated"]["path"])
 async def get_all_wines_paginated(
-    page: int, page_size: int
+    params: Annotated[GetAllWinesPaginatedRequest, Query()],
 ) -> PaginatedList[Wine]:
-    return impl.get_all_wines_paginated(page, page_size)
+    return impl.get_all_wines_paginated(params.page, params.page_size, params.cursor)
+
+
+@app.get(CATALOG_SERVICE["browse_wines"]["path"])
+async def browse_wines(
+    params: BrowseWinesRequest = Depends(),
+) -> PaginatedList[Wine]:
+    return impl.browse_wines(params)
+
+
+# wines per chunk written to an export stream
+EXPORT_BATCH_SIZE = 256
+
+
+def ndjson_batches(wines: Iterator[Wine]) -> Iterator[bytes]:
+    batch = []
+    for wine in wines:
+        batch.append(wine.model_dump_json())
+        if len(batch) == EXPORT_BATCH_SIZE:
+            yield ("\n".join(batch) + "\n").encode("utf-8")
+            batch = []
+    if batch:
+        yield ("\n".join(batch) + "\n").encode("utf-8")
+
+
+def gzip_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        if compressed := compressor.compress(chunk):
+            yield compressed
+    yield compressor.flush()
+
+
+@app.get(CATALOG_SERVICE["export_wines"]["path"])
+def export_wines(params: ExportWinesRequest = Depends()) -> StreamingResponse:
+    body = ndjson_batches(impl.export_wines(params))
+    headers = {}
+    if params.compress:
+        body = gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
@@ -1,6 +1,6 @@
-from typing import List, Tuple
+from typing import List, Literal, Tuple
 import typing
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class Wine(BaseModel):
@@ -26,6 +26,7 @@ class PaginatedList[T](BaseModel):
     page: int
     page_size: int
     total_pages: int
+    next_cursor: str | None = None
 
     class Config:
         generic_types_only = True
@@ -38,6 +39,16 @@ class ServiceMethodDef(typing.TypedDict):
     path: str
     params: BaseModel | None
     response: BaseModel | List[BaseModel] | None
+    # the response is a stream of newline delimited response objects
+    stream: typing.NotRequired[bool]
+    # the request field holding a list of keys, for methods that respond with
+    # one item per key, in order, that only changes with the data version.
+    # generated caching clients cache these per key
+    cache_by: typing.NotRequired[str]
+
+
+# the most items one page of a paginated response can hold
+MAX_PAGE_SIZE = 1000
 
 
 class GetWineRequest(BaseModel):
@@ -45,8 +56,32 @@ class GetWineRequest(BaseModel):
 
 
 class GetAllWinesPaginatedRequest(BaseModel):
-    page: int
-    page_size: int
+    page: int = Field(1, ge=1)
+    page_size: int = Field(ge=1, le=MAX_PAGE_SIZE)
+    cursor: str | None = None
+
+
+class BrowseWinesRequest(BaseModel):
+    country: str | None = None
+    variety: str | None = None
+    winery: str | None = None
+    min_points: float | None = None
+    max_points: float | None = None
+    min_price: float | None = None
+    max_price: float | None = None
+    sort_by: Literal["id", "points", "price"] = "id"
+    descending: bool = False
+    page: int = Field(1, ge=1)
+    page_size: int = Field(20, ge=1, le=MAX_PAGE_SIZE)
+
+
+class ExportWinesRequest(BaseModel):
+    start_id: int = 0
+    end_id: int | None = None
+    country: str | None = None
+    variety: str | None = None
+    winery: str | None = None
+    compress: bool = False
 
 
 CATALOG_SERVICE = {
@@ -55,6 +90,7 @@ CATALOG_SERVICE = {
         path="/wines/",
         params=GetWineRequest,
         response=List[Wine],
+        cache_by="ids",
     ),
     "get_all_wines_paginated": ServiceMethodDef(
         method="GET",
@@ -62,13 +98,32 @@ CATALOG_SERVICE = {
         params=GetAllWinesPaginatedRequest,
         response=PaginatedList[Wine],
     ),
+    "browse_wines": ServiceMethodDef(
+        method="GET",
+        path="/wines/browse/",
+        params=BrowseWinesRequest,
+        response=PaginatedList[Wine],
+    ),
+    "export_wines": ServiceMethodDef(
+        method="GET",
+        path="/wines/export/",
+        params=ExportWinesRequest,
+        response=Wine,
+        stream=True,
+    ),
 }
 
 
 class SearchRequest(BaseModel):
     query: str
-    page: int = 1
-    page_size: int = 20
+    page: int = Field(1, ge=1)
+    page_size: int = Field(20, ge=1, le=MAX_PAGE_SIZE)
+    cursor: str | None = None
+
+
+class AutocompleteRequest(BaseModel):
+    prefix: str
+    limit: int = 10
 
 
 SEARCH_SERVICE = {
@@ -77,7 +132,13 @@ SEARCH_SERVICE = {
         path="/search/",
         params=SearchRequest,
         response=PaginatedList[int],
-    )
+    ),
+    "autocomplete": ServiceMethodDef(
+        method="GET",
+        path="/search/autocomplete/",
+        params=AutocompleteRequest,
+        response=List[str],
+    ),
 }
 
 
@@ -86,23 +147,90 @@ class RecsRequest(BaseModel):
     limit: int = 20
 
 
+def normalize_query(query: str) -> str:
+    """
+    A search or recs query with its whitespace collapsed, since that never
+    changes what it means, for keying work and caches on the query
+    """
+    return " ".join(query.split())
+
+
+class CellarRecsRequest(BaseModel):
+    # recommend for everything in this user's cellar, or for one wine, or both
+    user_id: int | None = None
+    wine_id: int | None = None
+    limit: int = 20
+
+
 RECS_SERVICE = {
     "get_recommendations": ServiceMethodDef(
         method="GET",
         path="/recommendations/",
         params=RecsRequest,
         response=PaginatedList[int],
-    )
+    ),
+    "get_cellar_recommendations": ServiceMethodDef(
+        method="GET",
+        path="/recommendations/cellar/",
+        params=CellarRecsRequest,
+        response=List[int],
+    ),
 }
 
 
 class SQLRequest(BaseModel):
     query: str
     params: list[str | int] | None
+    # the user whose shard the query runs on. without one, queries run on
+    # every shard, and are only allowed to read. the caller is trusted to
+    # only touch that user's rows, anything else ends up on the wrong shard
+    user_id: int | None = None
+
+
+class CellarRequest(BaseModel):
+    user_id: int
+    wine_id: int
+
+
+class GetCellarRequest(BaseModel):
+    user_id: int
+
+
+class CellarChangesRequest(BaseModel):
+    cursor: str | None = None
+    limit: int = 1000
+
+
+class CellarChange(BaseModel):
+    user_id: int
+    wine_id: int
+    # False when the wine was removed from the cellar
+    added: bool
+
+
+class CellarChanges(BaseModel):
+    changes: List[CellarChange]
+    # pass back to get the changes made after these, even when there were none
+    cursor: str
 
 
 PERSIST_SERVICE = {
     "do_sql": ServiceMethodDef(
         method="POST", path="/do_sql/", params=SQLRequest, response=List[Tuple]
-    )
+    ),
+    "add_to_cellar": ServiceMethodDef(
+        method="POST", path="/cellar/add/", params=CellarRequest, response=None
+    ),
+    "remove_from_cellar": ServiceMethodDef(
+        method="POST", path="/cellar/remove/", params=CellarRequest, response=None
+    ),
+    "get_cellar": ServiceMethodDef(
+        method="GET", path="/cellar/", params=GetCellarRequest, response=List[int]
+    ),
+    "get_cellar_changes": ServiceMethodDef(
+        method="GET",
+        path="/cellar/changes/",
+        params=CellarChangesRequest,
+        response=CellarChanges,
+    ),
 }
@@ -1,5 +1,7 @@
+from typing import Iterator
 from pydantic import TypeAdapter
 from .api import *
+from .cache import VersionedCache
 from .http_client import HttpClient, HttpClientOptions
 
 #
@@ -33,6 +35,46 @@ class CatalogService:
             )
         )
 
+    def browse_wines(
+        self,
+        request: BrowseWinesRequest,
+        options: HttpClientOptions = HttpClientOptions(),
+    ) -> PaginatedList[Wine]:
+        return PaginatedList[Wine].model_validate(
+            self.client.get(
+                CATALOG_SERVICE["browse_wines"]["path"], request.model_dump(), options
+            )
+        )
+
+    def export_wines(
+        self,
+        request: ExportWinesRequest,
+        options: HttpClientOptions = HttpClientOptions(),
+    ) -> Iterator[Wine]:
+        for item in self.client.get_stream(
+            CATALOG_SERVICE["export_wines"]["path"], request.model_dump(), options
+        ):
+            yield Wine.model_validate(item)
+
+
+class CachingCatalogService(CatalogService):
+    def __init__(self, client: HttpClient, cache: VersionedCache):
+        super().__init__(client)
+        self.cache = cache
+
+    def get_wine(
+        self, request: GetWineRequest, options: HttpClientOptions = HttpClientOptions()
+    ) -> List:
+        def fetch(keys):
+            response, headers = self.client.get_with_headers(
+                CATALOG_SERVICE["get_wine"]["path"],
+                request.model_copy(update={"ids": keys}).model_dump(),
+                options,
+            )
+            return TypeAdapter(List).validate_python(response), headers
+
+        return self.cache.get_many(request.ids, fetch)
+
 
 class SearchService:
     def __init__(self, client: HttpClient):
@@ -47,6 +89,17 @@ class SearchService:
             )
         )
 
+    def autocomplete(
+        self,
+        request: AutocompleteRequest,
+        options: HttpClientOptions = HttpClientOptions(),
+    ) -> List:
+        return TypeAdapter(List).validate_python(
+            self.client.get(
+                SEARCH_SERVICE["autocomplete"]["path"], request.model_dump(), options
+            )
+        )
+
 
 class RecsService:
     def __init__(self, client: HttpClient):
@@ -63,6 +116,19 @@ class RecsService:
             )
         )
 
+    def get_cellar_recommendations(
+        self,
+        request: CellarRecsRequest,
+        options: HttpClientOptions = HttpClientOptions(),
+    ) -> List:
+        return TypeAdapter(List).validate_python(
+            self.client.get(
+                RECS_SERVICE["get_cellar_recommendations"]["path"],
+                request.model_dump(),
+                options,
+            )
+        )
+
 
 class PersistService:
     def __init__(self, client: HttpClient):
@@ -76,3 +142,41 @@ class PersistService:
                 PERSIST_SERVICE["do_sql"]["path"], request.model_dump(), options
             )
         )
+
+    def add_to_cellar(
+        self, request: CellarRequest, options: HttpClientOptions = HttpClientOptions()
+    ) -> None:
+        return self.client.post(
+            PERSIST_SERVICE["add_to_cellar"]["path"], request.model_dump(), options
+        )
+
+    def remove_from_cellar(
+        self, request: CellarRequest, options: HttpClientOptions = HttpClientOptions()
+    ) -> None:
+        return self.client.post(
+            PERSIST_SERVICE["remove_from_cellar"]["path"], request.model_dump(), options
+        )
+
+    def get_cellar(
+        self,
+        request: GetCellarRequest,
+        options: HttpClientOptions = HttpClientOptions(),
+    ) -> List:
+        return TypeAdapter(List).validate_python(
+            self.client.get(
+                PERSIST_SERVICE["get_cellar"]["path"], request.model_dump(), options
+            )
+        )
+
+    def get_cellar_changes(
+        self,
+        request: CellarChangesRequest,
+        options: HttpClientOptions = HttpClientOptions(),
+    ) -> CellarChanges:
+        return CellarChanges.model_validate(
+            self.client.get(
+                PERSIST_SERVICE["get_cellar_changes"]["path"],
+                request.model_dump(),
+                options,
+            )
+        )
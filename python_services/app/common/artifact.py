@@ -0,0 +1,159 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+from typing import Dict
+from .reloader import publish_data_version
+
+MANIFEST_FILE = "manifest.json"
+ARTIFACT_FORMAT = 1
+# the versioned data build_data.py produces, relative to the data path. user
+# data in persist's databases is never part of an artifact
+ARTIFACT_CONTENTS = [
+    "catalog_data.csv",
+    "search_data",
+    "recs_data",
+]
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _list_files(data_path: str) -> Dict[str, Dict]:
+    files = {}
+    for name in ARTIFACT_CONTENTS:
+        path = os.path.join(data_path, name)
+        if os.path.isfile(path):
+            paths = [path]
+        else:
+            paths = [
+                os.path.join(root, file)
+                for root, _, dir_files in os.walk(path)
+                for file in dir_files
+            ]
+        for file_path in paths:
+            rel_path = os.path.relpath(file_path, data_path).replace(os.sep, "/")
+            files[rel_path] = {
+                "sha256": _sha256_file(file_path),
+                "size": os.path.getsize(file_path),
+            }
+    return dict(sorted(files.items()))
+
+
+def _content_digest(files: Dict[str, Dict]) -> str:
+    canonical = json.dumps(files, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def artifact_version(digest: str) -> str:
+    return digest[:16]
+
+
+def pack_artifact(data_path: str, out_dir: str) -> str:
+    """
+    Package the built data in data_path into a single tar named after the
+    digest of its contents, with a manifest listing the checksum of every
+    file. Building the same data twice gives a byte-identical artifact.
+    """
+    files = _list_files(data_path)
+    if not files:
+        raise ArtifactError(f"no data to package in {data_path}")
+    digest = _content_digest(files)
+    manifest = json.dumps(
+        {"format": ARTIFACT_FORMAT, "digest": digest, "files": files},
+        indent=2,
+    ).encode("utf-8")
+
+    os.makedirs(out_dir, exist_ok=True)
+    artifact_path = os.path.join(
+        out_dir, f"wineinfo-data-{artifact_version(digest)}.tar"
+    )
+    tmp_path = artifact_path + f".tmp{os.getpid()}"
+    with tarfile.open(tmp_path, "w") as tar:
+        # the manifest goes first so installs can check it before reading
+        # the rest of the archive
+        info = tarfile.TarInfo(MANIFEST_FILE)
+        info.size = len(manifest)
+        tar.addfile(info, io.BytesIO(manifest))
+        for rel_path in files:
+            info = tar.gettarinfo(os.path.join(data_path, rel_path), rel_path)
+            info.mtime = 0
+            info.uid = info.gid = 0
+            info.uname = info.gname = ""
+            with open(os.path.join(data_path, rel_path), "rb") as file:
+                tar.addfile(info, file)
+    os.replace(tmp_path, artifact_path)
+    return artifact_path
+
+
+def install_artifact(artifact_path: str, data_path: str) -> str:
+    """
+    Verify an artifact and unpack it as a version of data_path, then publish
+    that version. Artifacts already unpacked by an earlier start are reused
+    without extracting them again. Returns the installed version.
+    """
+    with tarfile.open(artifact_path, "r") as tar:
+        try:
+            manifest = json.load(tar.extractfile(MANIFEST_FILE))
+        except (KeyError, ValueError) as e:
+            raise ArtifactError(f"{artifact_path} has no valid manifest") from e
+        if manifest.get("format") != ARTIFACT_FORMAT:
+            raise ArtifactError(f"unsupported artifact format {manifest.get('format')}")
+        files = manifest["files"]
+        digest = _content_digest(files)
+        if digest != manifest["digest"]:
+            raise ArtifactError(f"{artifact_path} manifest does not match its digest")
+
+        version = artifact_version(digest)
+        version_path = os.path.join(data_path, version)
+        # versions are only ever renamed into place after being verified, so
+        # an existing directory is a complete, verified copy
+        if not os.path.exists(version_path):
+            os.makedirs(data_path, exist_ok=True)
+            tmp_path = os.path.join(data_path, f".{version}.tmp{os.getpid()}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            members = [m for m in tar.getmembers() if m.name != MANIFEST_FILE]
+            tar.extractall(tmp_path, members=members, filter="data")
+            try:
+                _verify(tmp_path, files)
+            except ArtifactError:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+            try:
+                os.replace(tmp_path, version_path)
+            except OSError:
+                # another service sharing the data path installed it first
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                if not os.path.exists(version_path):
+                    raise
+
+    publish_data_version(data_path, version)
+    return version
+
+
+def _verify(path: str, files: Dict[str, Dict]):
+    found = {
+        os.path.relpath(os.path.join(root, file), path).replace(os.sep, "/")
+        for root, _, dir_files in os.walk(path)
+        for file in dir_files
+    }
+    if found != set(files):
+        raise ArtifactError("artifact contents do not match its manifest")
+    for rel_path, expected in files.items():
+        file_path = os.path.join(path, rel_path)
+        if (
+            os.path.getsize(file_path) != expected["size"]
+            or _sha256_file(file_path) != expected["sha256"]
+        ):
+            raise ArtifactError(f"checksum mismatch for {rel_path}")
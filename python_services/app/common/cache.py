@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Mapping, Sequence, Tuple
+from .http_client import HttpClient
+from .metrics import metrics
+from .reloader import DATA_VERSION_HEADER, HEALTH_PATH
+
+cache_lookups = metrics.counter(
+    "wineinfo_client_cache_lookups_total",
+    "Keys looked up in client side caches of another service's data",
+    ["name", "result"],
+)
+
+# fetches the items for some keys, one per key in order, along with the
+# response headers so the data version can be read from them
+Fetch = Callable[[List[Hashable]], Tuple[List, Mapping[str, str]]]
+
+
+class VersionedCache:
+    """
+    A read-through LRU of items by key, for data that only changes when the
+    service it comes from publishes a new data version.
+
+    The version is read from the X-Data-Version header of every fetch, and
+    checked against the service's health endpoint at most once every
+    revalidate_interval seconds so a cache that is serving every lookup
+    still notices new versions. Everything cached is dropped when the version
+    changes. A service with unversioned data has no version to check, so
+    its items are dropped every revalidate_interval instead.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        client: HttpClient,
+        max_items: int,
+        revalidate_interval: float,
+    ):
+        self.name = name
+        self.client = client
+        self.max_items = max_items
+        self.revalidate_interval = revalidate_interval
+        self.items: OrderedDict[Hashable, object] = OrderedDict()
+        self.version: str | None = None
+        self.validated_at = 0.0
+        self.lock = threading.Lock()
+
+    def _set_version(self, version: str | None):
+        with self.lock:
+            if version != self.version or version is None:
+                self.items.clear()
+                self.version = version
+            self.validated_at = time.monotonic()
+
+    def _revalidate(self):
+        if time.monotonic() - self.validated_at < self.revalidate_interval:
+            return
+        _, headers = self.client.get_with_headers(HEALTH_PATH, {})
+        self._set_version(headers.get(DATA_VERSION_HEADER))
+
+    def get_many(self, keys: Sequence[Hashable], fetch: Fetch) -> List:
+        """The items for keys, fetching only the ones not cached in one call"""
+        self._revalidate()
+        found: Dict[Hashable, object] = {}
+        with self.lock:
+            version = self.version
+            for key in keys:
+                if key in self.items:
+                    self.items.move_to_end(key)
+                    found[key] = self.items[key]
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        cache_lookups.inc(len(keys) - len(missing), name=self.name, result="hit")
+        cache_lookups.inc(len(missing), name=self.name, result="miss")
+        if not missing:
+            return [found[key] for key in keys]
+
+        items, headers = fetch(missing)
+        fetched_version = headers.get(DATA_VERSION_HEADER)
+        if fetched_version != version:
+            # the cached items are from an older version than the fetched
+            # ones, so fetch everything again rather than mix the two
+            self._set_version(fetched_version)
+            items, headers = fetch(list(dict.fromkeys(keys)))
+            missing = list(dict.fromkeys(keys))
+            found = {}
+        found.update(zip(missing, items))
+
+        with self.lock:
+            if self.version == headers.get(DATA_VERSION_HEADER):
+                for key in missing:
+                    self.items[key] = found[key]
+                    self.items.move_to_end(key)
+                while len(self.items) > self.max_items:
+                    self.items.popitem(last=False)
+        return [found[key] for key in keys]
@@ -0,0 +1,92 @@
+import zlib
+from typing import List, Tuple
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+from urllib3.util.request import ACCEPT_ENCODING as DECODABLE_ENCODINGS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# in order of preference
+SERVER_ENCODINGS = ["zstd", "gzip"] if zstandard else ["gzip"]
+# what HttpClient asks for: urllib3 only decodes zstd when it has a zstd
+# library of its own available
+CLIENT_ACCEPT_ENCODING = ", ".join(
+    encoding
+    for encoding in ["zstd", "gzip"]
+    if encoding in DECODABLE_ENCODINGS.split(",")
+)
+
+
+def parse_accept_encoding(header: str) -> List[Tuple[str, float]]:
+    encodings = []
+    for item in header.split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        encodings.append((name.lower(), quality))
+    return encodings
+
+
+def choose_encoding(header: str) -> str | None:
+    """The preferred encoding both sides support, or None for identity"""
+    qualities = dict(parse_accept_encoding(header))
+    best = None
+    for encoding in SERVER_ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+
+def compress(body: bytes, encoding: str, level: int) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    compressor = zlib.compressobj(level, wbits=zlib.MAX_WBITS | 16)
+    return compressor.compress(body) + compressor.flush()
+
+
+def create_compression_middleware(minimum_size: int, level: int):
+    async def compression_middleware(request: Request, call_next):
+        response = await call_next(request)
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+        if encoding is None or "content-encoding" in response.headers:
+            return response
+        # streaming responses have no length and are passed through as they
+        # are, so they keep their constant memory use
+        length = response.headers.get("content-length")
+        if length is None or int(length) < minimum_size:
+            return response
+
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        # large bodies take long enough to compress that it shouldn't
+        # happen on the event loop
+        compressed = await run_in_threadpool(compress, body, encoding, level)
+        compressed_response = Response(compressed, status_code=response.status_code)
+        vary = response.headers.get("vary")
+        compressed_response.raw_headers = [
+            (k, v)
+            for k, v in response.raw_headers
+            if k not in (b"content-length", b"vary")
+        ] + [
+            (b"content-length", str(len(compressed)).encode("latin-1")),
+            (b"content-encoding", encoding.encode("latin-1")),
+            (
+                b"vary",
+                (f"{vary}, Accept-Encoding" if vary else "Accept-Encoding").encode(
+                    "latin-1"
+                ),
+            ),
+        ]
+        return compressed_response
+
+    return compression_middleware
@@ -0,0 +1,183 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Deque, Sequence
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from .metrics import METRICS_PATH, metrics
+from .profiling import PROFILE_PATH
+from .reloader import HEALTH_PATH
+from .tracing import TRACES_PATH
+
+# operational endpoints answer even when the service is overloaded, so it can
+# still be checked on and debugged
+EXEMPT_PATHS = (HEALTH_PATH, METRICS_PATH, TRACES_PATH, PROFILE_PATH)
+# how far latency may rise above its long term average before the limit
+# starts coming down
+LATENCY_TOLERANCE = 1.5
+# weights of each new latency sample in the short and long term averages
+SHORT_RTT_WEIGHT = 0.1
+LONG_RTT_WEIGHT = 0.002
+LIMIT_SMOOTHING = 0.2
+
+concurrency_limit = metrics.gauge(
+    "wineinfo_concurrency_limit",
+    "Requests the adaptive concurrency limiter currently lets run at once",
+)
+concurrency_queued = metrics.gauge(
+    "wineinfo_concurrency_queued",
+    "Requests waiting for the adaptive concurrency limiter",
+)
+queue_delay = metrics.histogram(
+    "wineinfo_concurrency_queue_delay_seconds",
+    "Time requests waited for the adaptive concurrency limiter",
+)
+shed_requests = metrics.counter(
+    "wineinfo_shed_requests_total",
+    "Requests rejected with a 429 by the adaptive concurrency limiter",
+    ["reason"],
+)
+
+
+class AdaptiveLimiter:
+    """
+    Limits how many requests run at once, adjusting the limit from observed
+    latency. While latency stays near its long term average the limit grows
+    by about the square root of itself, and when latency rises above that
+    the limit shrinks in proportion, so the service keeps working at the
+    concurrency it can actually sustain instead of letting work pile up
+    behind it.
+
+    Requests over the limit wait in a bounded FIFO queue for at most
+    target_queue_delay seconds. Requests that find the queue full or that
+    wait longer are shed. Must only be used from one event loop.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        max_queue: int,
+        target_queue_delay: float,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.target_queue_delay = target_queue_delay
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.short_rtt: float | None = None
+        self.long_rtt: float | None = None
+        concurrency_limit.set(self.limit)
+
+    async def acquire(self) -> bool:
+        """Wait for a slot, returning False if the request should be shed"""
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            return True
+        if len(self.waiters) >= self.max_queue:
+            shed_requests.inc(reason="queue_full")
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        concurrency_queued.inc()
+        try:
+            await asyncio.wait((waiter,), timeout=self.target_queue_delay)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        if waiter.done():
+            return True
+        self._abandon(waiter)
+        shed_requests.inc(reason="queue_timeout")
+        return False
+
+    def release(self, rtt: float, in_flight: int, ok: bool):
+        """
+        Give back a slot, taking rtt as a sample of latency if the request
+        succeeded. in_flight is how many requests were running when it started.
+        """
+        if ok:
+            self._update_limit(rtt, in_flight)
+        self.in_flight -= 1
+        self._wake()
+
+    def retry_after(self) -> int:
+        """Seconds a shed caller should wait before trying again"""
+        return max(1, math.ceil(self.long_rtt or 0))
+
+    def _update_limit(self, rtt: float, in_flight: int):
+        if self.short_rtt is None:
+            self.short_rtt = self.long_rtt = rtt
+            return
+        self.short_rtt += SHORT_RTT_WEIGHT * (rtt - self.short_rtt)
+        self.long_rtt += LONG_RTT_WEIGHT * (rtt - self.long_rtt)
+        # after a long spell of high latency the long term average has crept
+        # up, so pull it back down once latency recovers
+        if self.long_rtt / self.short_rtt > 2:
+            self.long_rtt *= 0.95
+        # with most of the limit unused latency says nothing about whether
+        # the limit is right, so leave it alone
+        if in_flight < self.limit / 2:
+            return
+
+        gradient = max(
+            0.5, min(1.0, LATENCY_TOLERANCE * self.long_rtt / self.short_rtt)
+        )
+        new_limit = self.limit * gradient + math.sqrt(self.limit)
+        self.limit += LIMIT_SMOOTHING * (new_limit - self.limit)
+        self.limit = max(self.min_limit, min(self.max_limit, self.limit))
+        concurrency_limit.set(self.limit)
+
+    def _wake(self):
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            concurrency_queued.dec()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.in_flight += 1
+
+    def _abandon(self, waiter: asyncio.Future):
+        if waiter.done():
+            # handed a slot just as it gave up, so pass the slot on
+            self.in_flight -= 1
+            self._wake()
+        else:
+            waiter.cancel()
+            self.waiters.remove(waiter)
+            concurrency_queued.dec()
+
+
+def create_concurrency_middleware(
+    limiter: AdaptiveLimiter, exempt_paths: Sequence[str] = EXEMPT_PATHS
+):
+    exempt = tuple(exempt_paths)
+
+    async def concurrency_middleware(request: Request, call_next):
+        if request.url.path.startswith(exempt):
+            return await call_next(request)
+
+        start = time.perf_counter()
+        if not await limiter.acquire():
+            return JSONResponse(
+                {"detail": "Service overloaded"},
+                status_code=429,
+                headers={"Retry-After": str(limiter.retry_after())},
+            )
+        queue_delay.observe(time.perf_counter() - start)
+
+        in_flight = limiter.in_flight
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = await call_next(request)
+            ok = response.status_code < 500
+            return response
+        finally:
+            limiter.release(time.perf_counter() - start, in_flight, ok)
+
+    return concurrency_middleware
@@ -1,3 +1,4 @@
+from typing import Literal
 from pydantic_settings import BaseSettings
 
 
@@ -8,6 +9,61 @@ class ServiceSettings(BaseSettings):
     persist_service: str = "http://localhost:8004"
     use_junction: bool = False
     data_path: str = "python_services/data/gen"
+    # seconds between checks for a newly published data version, 0 disables
+    data_reload_interval: float = 10.0
+    # a data artifact built by build_data.py --artifact to install at startup
+    data_artifact: str | None = None
     catalog_demo_mojibake: bool = False
     search_demo_latency: bool = False
     recs_demo_failure: bool = False
+    # recs counts how often each query is asked in a file, relative to
+    # data_path unless it's absolute, and warms its caches with the most
+    # frequent ones before reporting healthy. an empty file name turns this off
+    recs_hot_queries_file: str = "hot_queries.json"
+    recs_hot_queries_save_interval: float = 30.0
+    recs_prewarm_queries: int = 200
+    recs_embedding_cache_size: int = 10000
+    recs_result_cache_size: int = 10000
+    # recs follows cellar changes in persist every this many seconds to keep
+    # its cellar recommendations current, 0 disables cellar recommendations
+    recs_cellar_sync_interval: float = 5.0
+    recs_cellar_sync_batch_size: int = 1000
+    # similar wines kept for each wine in the cellar recommendations model
+    recs_cellar_neighbors: int = 50
+    # limit how many recs requests run at once, adapting the limit to latency
+    recs_concurrency_limit: bool = True
+    search_spelling_correction: bool = True
+    # responses smaller than this many bytes are sent uncompressed
+    compression_minimum_size: int = 1024
+    compression_level: int = 6
+    # where finished spans go: "ring" keeps them in memory for /traces/,
+    # "log" writes them to the log, "none" drops them
+    trace_sink: Literal["ring", "log", "none"] = "ring"
+    trace_buffer_size: int = 10000
+    # sampling profiler triggered by profile=1 in baggage or from /profile/
+    profiling_enabled: bool = False
+    profile_dir: str = "/tmp/wineinfo-profiles"
+    profile_interval: float = 0.005
+    # per-request profiles kept in profile_dir, the oldest are deleted first
+    profile_max_files: int = 100
+    # recs caches this many wines from catalog, 0 disables the cache
+    catalog_cache_size: int = 10000
+    # seconds between checks that cached catalog data is still current
+    catalog_cache_revalidate_interval: float = 5.0
+    # defaults for calls to other services. the timeout covers every attempt
+    # at a call, and retries and hedging only apply to GETs
+    client_timeout: float | None = None
+    client_retries: int = 0
+    client_hedge: bool = False
+    # persist splits user data across this many databases by user_id. it can
+    # only be changed after moving the data with bin/rebalance_persist.py
+    persist_shards: int = 1
+    # connections kept open to each persist shard
+    persist_pool_size: int = 4
+    # adaptive concurrency limits. requests over the limit queue for at most
+    # concurrency_target_queue_delay seconds before they're shed with a 429
+    concurrency_initial_limit: int = 20
+    concurrency_min_limit: int = 2
+    concurrency_max_limit: int = 40
+    concurrency_max_queue: int = 100
+    concurrency_target_queue_delay: float = 0.05
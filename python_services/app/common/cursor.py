@@ -0,0 +1,23 @@
+import base64
+import binascii
+import json
+from typing import Dict
+from fastapi import HTTPException
+
+
+def encode_cursor(position: Dict) -> str:
+    """Encode a pagination position as an opaque, url-safe token"""
+    data = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict:
+    """Decode a token produced by encode_cursor, rejecting anything else"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(position, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return position
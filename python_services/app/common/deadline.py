@@ -0,0 +1,73 @@
+import time
+from contextvars import ContextVar
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from .baggage import baggage_mgr
+from .metrics import metrics
+
+# baggage key holding the time, in seconds since the epoch, after which the
+# caller no longer wants the result
+DEADLINE_KEY = "deadline"
+
+deadline_exceeded = metrics.counter(
+    "wineinfo_deadline_exceeded_total",
+    "Requests dropped because their caller's deadline had passed",
+    ["stage"],
+)
+_deadline: ContextVar[float | None] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=504, detail="Deadline exceeded")
+
+
+def parse_deadline(value: str | None) -> float | None:
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def current_deadline() -> float | None:
+    """The deadline of the request being handled, if its caller set one"""
+    return _deadline.get()
+
+
+def remaining_time() -> float | None:
+    deadline = current_deadline()
+    return None if deadline is None else deadline - time.time()
+
+
+def check_deadline():
+    """Give up on the current request if its caller has already given up"""
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        deadline_exceeded.inc(stage="handler")
+        raise DeadlineExceeded()
+
+
+def sleep(seconds: float):
+    """Sleep, but no later than the deadline, and give up if it's reached"""
+    remaining = remaining_time()
+    if remaining is not None and remaining < seconds:
+        time.sleep(max(remaining, 0))
+        check_deadline()
+    else:
+        time.sleep(seconds)
+
+
+def create_deadline_middleware():
+    async def deadline_middleware(request: Request, call_next):
+        baggage = baggage_mgr.parse_headers(request.headers.getlist("baggage"))
+        deadline = parse_deadline(baggage.get(DEADLINE_KEY))
+        if deadline is not None and deadline <= time.time():
+            deadline_exceeded.inc(stage="received")
+            return JSONResponse({"detail": "Deadline exceeded"}, status_code=504)
+        token = _deadline.set(deadline)
+        try:
+            return await call_next(request)
+        finally:
+            _deadline.reset(token)
+
+    return deadline_middleware
@@ -1,53 +1,354 @@
-from typing import Dict, Literal
+import contextvars
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterator, Literal, Mapping, Tuple
 import junction.requests
 import requests
 from .baggage import baggage_mgr
+from .compression import CLIENT_ACCEPT_ENCODING
+from .deadline import DEADLINE_KEY, remaining_time
+from .metrics import metrics
+from .tracing import tracer
 
+# statuses that mean the server didn't handle the request, and a retry may
+# go better
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+# observed latencies kept per path, and how many are needed before they're
+# trusted to pick a hedging delay
+LATENCY_WINDOW = 1000
+MIN_LATENCY_SAMPLES = 20
+# when many calls to a path are slow its high percentiles are as slow as
+# they are, and a hedge that waits that long never helps. so the hedging
+# delay is also capped at a few times the latency of a quick call
+HEDGE_BASE_PERCENTILE = 25.0
+HEDGE_MAX_MULTIPLE = 3.0
+MIN_BACKOFF = 0.01
+MAX_BACKOFF = 1.0
+HEDGE_WORKERS = 64
 
+hedged_requests = metrics.counter(
+    "wineinfo_client_hedged_requests_total",
+    "Backup requests sent because the first was slower than usual",
+    ["path"],
+)
+retried_requests = metrics.counter(
+    "wineinfo_client_retried_requests_total",
+    "Requests retried after a failure",
+    ["path"],
+)
+
+
+@dataclass
 class HttpClientOptions:
-    headers: Dict = {}
+    headers: Dict = field(default_factory=dict)
     use_baggage_mgr: bool = True
-    baggage_updates: Dict[str, str] = {}
+    baggage_updates: Dict[str, str] = field(default_factory=dict)
+    # per call overrides of the client's defaults, None uses the client's
+    timeout: float | None = None
+    retries: int | None = None
+    hedge: bool | None = None
+
+
+class LatencyWindow:
+    """
+    The most recent latencies of the responses calls to one path returned.
+    When a call is hedged only the attempt that won counts, so slow attempts
+    that hedging made up for don't drag up the percentiles.
+    """
+
+    def __init__(self):
+        self.samples: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percentile: float) -> float | None:
+        with self.lock:
+            if len(self.samples) < MIN_LATENCY_SAMPLES:
+                return None
+            samples = sorted(self.samples)
+        return samples[min(int(len(samples) * percentile / 100), len(samples) - 1)]
+
+
+def _retry_after(response: requests.Response) -> float:
+    try:
+        return float(response.headers.get("Retry-After", 0))
+    except ValueError:
+        return 0.0
+
+
+def _close_response(future: Future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
 
 
 class HttpClient:
-    def __init__(self, base_url: str, use_junction: bool = False):
+    """
+    An HTTP client for calling other services.
+
+    timeout is the total time a call may take across all of its attempts.
+    GETs are retried up to retries times on connection errors and on
+    responses saying the server couldn't handle them, with full jitter
+    backoff scaled to the path's usual latency and never past the timeout.
+    With hedge, a GET that takes longer than hedge_percentile of recent
+    calls to the same path, or a few times as long as a quick one, gets a
+    backup request, and whichever answers first wins. POSTs aren't idempotent, so they're never retried or hedged.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        use_junction: bool = False,
+        timeout: float | None = None,
+        retries: int = 0,
+        hedge: bool = False,
+        hedge_percentile: float = 95.0,
+    ):
         self.base_url = base_url.rstrip("/")
         self.session = (
             junction.requests.Session() if use_junction else requests.Session()
         )
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.latencies: Dict[str, LatencyWindow] = defaultdict(LatencyWindow)
+        self._executor: ThreadPoolExecutor | None = None
+        self._executor_lock = threading.Lock()
 
     def _get_headers(
-        self, method: Literal["GET", "POST"], options: HttpClientOptions
+        self,
+        method: Literal["GET", "POST"],
+        options: HttpClientOptions,
+        call_baggage: Dict[str, str],
     ) -> Dict:
         headers = options.headers.copy()
+        headers.setdefault("Accept-Encoding", CLIENT_ACCEPT_ENCODING)
         if method == "POST":
             headers["Content-Type"] = "application/json"
         baggage = {}
         if options.use_baggage_mgr:
-            baggage = baggage_mgr.get_current()
+            # copy, so updates don't leak into the caller's context
+            baggage = dict(baggage_mgr.get_current())
         if options.baggage_updates:
             baggage.update(options.baggage_updates)
+        baggage.update(call_baggage)
         if len(baggage) > 0:
             headers["baggage"] = ",".join([f"{k}={v}" for k, v in baggage.items()])
         return headers
 
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    HEDGE_WORKERS, thread_name_prefix="http-hedge"
+                )
+            return self._executor
+
+    def _deadline(self, options: HttpClientOptions) -> float | None:
+        """
+        When the call must finish by, on the monotonic clock: the sooner of
+        the call's own timeout and the deadline of the request being handled
+        """
+        deadline = None
+        timeout = self.timeout if options.timeout is None else options.timeout
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        if (inherited := remaining_time()) is not None:
+            inherited += time.monotonic()
+            deadline = inherited if deadline is None else min(deadline, inherited)
+        return deadline
+
+    def _call_baggage(self, span, deadline: float | None) -> Dict[str, str]:
+        baggage = tracer.baggage(span)
+        if deadline is not None:
+            # deadlines travel as wall clock time, since the monotonic clock
+            # means nothing to another process
+            wall_deadline = time.time() + deadline - time.monotonic()
+            baggage[DEADLINE_KEY] = f"{wall_deadline:.3f}"
+        return baggage
+
+    def _remaining(self, deadline: float | None) -> float | None:
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise requests.Timeout("deadline exceeded")
+        return remaining
+
+    def _send(
+        self,
+        method: Literal["GET", "POST"],
+        path: str,
+        options: HttpClientOptions,
+        deadline: float | None,
+        **kwargs,
+    ) -> requests.Response:
+        with tracer.span(f"{method} {path}", "client") as span:
+            headers = self._get_headers(
+                method, options, self._call_baggage(span, deadline)
+            )
+            response = getattr(self.session, method.lower())(
+                self.base_url + path,
+                headers=headers,
+                timeout=self._remaining(deadline),
+                **kwargs,
+            )
+            span.status = response.status_code
+        return response
+
+    def _hedge_delay(self, path: str) -> float | None:
+        latencies = self.latencies[path]
+        delay = latencies.percentile(self.hedge_percentile)
+        base = latencies.percentile(HEDGE_BASE_PERCENTILE)
+        if delay is None or base is None:
+            return None
+        return min(delay, base * HEDGE_MAX_MULTIPLE)
+
+    def _send_hedged(
+        self, path: str, options: HttpClientOptions, deadline: float | None, **kwargs
+    ) -> requests.Response:
+        delay = self._hedge_delay(path)
+        if delay is None:
+            return self._send("GET", path, options, deadline, **kwargs)
+
+        # attempts run on the executor so the caller can take whichever
+        # finishes first. each gets a copy of the caller's context so it
+        # carries the same baggage and trace
+        executor = self._get_executor()
+
+        def submit() -> Future:
+            context = contextvars.copy_context()
+            return executor.submit(
+                context.run, self._send, "GET", path, options, deadline, **kwargs
+            )
+
+        pending = {submit()}
+        done, _ = wait(pending, timeout=delay)
+        if not done:
+            hedged_requests.inc(path=path)
+            pending.add(submit())
+
+        fallback, error = None, None
+        while pending:
+            done, pending = wait(
+                pending, timeout=self._remaining(deadline), return_when=FIRST_COMPLETED
+            )
+            if not done:
+                raise requests.Timeout("deadline exceeded")
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.RequestException as e:
+                    error = e
+                    continue
+                if response.status_code in RETRYABLE_STATUSES:
+                    # only worth returning if the other attempt does no better
+                    fallback = response
+                    continue
+                # the loser can't be interrupted, so let it finish and clean
+                # up after itself
+                for other in pending:
+                    other.add_done_callback(_close_response)
+                return response
+        if fallback is not None:
+            return fallback
+        raise error
+
+    def _request(
+        self,
+        method: Literal["GET", "POST"],
+        path: str,
+        options: HttpClientOptions,
+        **kwargs,
+    ) -> requests.Response:
+        deadline = self._deadline(options)
+        retries = self.retries if options.retries is None else options.retries
+        hedge = self.hedge if options.hedge is None else options.hedge
+        if method != "GET":
+            retries, hedge = 0, False
+
+        for attempt in range(retries + 1):
+            try:
+                if hedge:
+                    response = self._send_hedged(path, options, deadline, **kwargs)
+                else:
+                    response = self._send(method, path, options, deadline, **kwargs)
+                if response.status_code not in RETRYABLE_STATUSES:
+                    self.latencies[path].add(response.elapsed.total_seconds())
+                    return response
+                error, retry_after = None, _retry_after(response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error, retry_after = None, e, 0.0
+
+            # full jitter, scaled to how long the path usually takes
+            base = max(self.latencies[path].percentile(50) or 0, MIN_BACKOFF)
+            cap = min(base * 2**attempt, MAX_BACKOFF)
+            backoff = max(random.uniform(0, cap), retry_after)
+            out_of_time = (
+                deadline is not None and time.monotonic() + backoff >= deadline
+            )
+            if attempt == retries or out_of_time:
+                break
+            retried_requests.inc(path=path)
+            time.sleep(backoff)
+
+        if error is not None:
+            raise error
+        return response
+
     def get(
         self, path: str, request: Dict, options: HttpClientOptions = HttpClientOptions()
     ) -> Dict:
-        headers = self._get_headers("GET", options)
-        response = self.session.get(
-            self.base_url + path, params=request, headers=headers
-        )
+        return self.get_with_headers(path, request, options)[0]
+
+    def get_with_headers(
+        self, path: str, request: Dict, options: HttpClientOptions = HttpClientOptions()
+    ) -> Tuple[Dict, Mapping[str, str]]:
+        response = self._request("GET", path, options, params=request)
         response.raise_for_status()
-        return response.json()
+        return response.json(), response.headers
 
     def post(
         self, path: str, request: Dict, options: HttpClientOptions = HttpClientOptions()
     ) -> Dict:
-        headers = self._get_headers("POST", options)
-        response = self.session.post(
-            self.base_url + path, json=request, headers=headers
-        )
+        response = self._request("POST", path, options, json=request)
         response.raise_for_status()
         return response.json()
+
+    def get_stream(
+        self, path: str, request: Dict, options: HttpClientOptions = HttpClientOptions()
+    ) -> Iterator[Dict]:
+        # streams can't be replayed, so they're never retried or hedged, and
+        # the timeout applies to each read rather than the whole stream. only
+        # the inherited deadline bounds the stream as a whole
+        timeout = self.timeout if options.timeout is None else options.timeout
+        deadline = None
+        if (inherited := remaining_time()) is not None:
+            deadline = time.monotonic() + inherited
+            remaining = self._remaining(deadline)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        # the span covers reading the whole stream, not just the first byte
+        with tracer.span(f"GET {path}", "client") as span:
+            headers = self._get_headers(
+                "GET", options, self._call_baggage(span, deadline)
+            )
+            with self.session.get(
+                self.base_url + path,
+                params=request,
+                headers=headers,
+                stream=True,
+                timeout=timeout,
+            ) as response:
+                span.status = response.status_code
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if line:
+                        yield json.loads(line)
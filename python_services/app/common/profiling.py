@@ -0,0 +1,150 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from .baggage import baggage_mgr
+from .tracing import tracer
+
+# baggage key that profiles a request, and every downstream request it makes
+# to a service with profiling enabled
+PROFILE_KEY = "profile"
+PROFILE_HEADER = "X-Profile"
+PROFILE_PATH = "/profile/"
+MAX_PROFILE_SECONDS = 60.0
+PROFILE_NAME = re.compile(r"^[\w.-]+\.collapsed$")
+# only stacks passing through our own code are kept, which drops idle
+# server and worker threads
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frame_label(code) -> str:
+    if code.co_filename.startswith(APP_DIR):
+        filename = os.path.relpath(code.co_filename, os.path.dirname(APP_DIR))
+    else:
+        # enough of library paths to tell which package they're from
+        filename = "/".join(code.co_filename.split(os.sep)[-2:])
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ",")
+
+
+def format_collapsed(stacks: Counter) -> str:
+    """The folded format read by flamegraph.pl, speedscope and friends"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread in the process from a background
+    thread. Nothing is traced, so the cost is one walk of each thread's
+    stack per interval, and nothing at all when no profile is running. Only
+    one profile runs at a time.
+    """
+
+    def __init__(self, profile_dir: str, interval: float, max_files: int):
+        self.profile_dir = profile_dir
+        self.interval = interval
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def _sample(self, stacks: Counter, stop: threading.Event):
+        sampler_id = threading.get_ident()
+        while not stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                labels = []
+                in_app = False
+                while frame is not None:
+                    in_app = in_app or frame.f_code.co_filename.startswith(APP_DIR)
+                    labels.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                if in_app:
+                    stacks[";".join(reversed(labels))] += 1
+
+    @contextmanager
+    def profile(self) -> Iterator[Counter]:
+        """
+        Sample for the duration of the with block. The yielded counter of
+        collapsed stacks is complete once the block exits.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        stacks = Counter()
+        stop = threading.Event()
+        thread = threading.Thread(target=self._sample, args=(stacks, stop), daemon=True)
+        thread.start()
+        try:
+            yield stacks
+        finally:
+            stop.set()
+            thread.join()
+            self._lock.release()
+
+    def save(self, name: str, stacks: Counter) -> str:
+        """Write a profile, deleting the oldest ones beyond max_files"""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        with open(os.path.join(self.profile_dir, name), "w") as file:
+            file.write(format_collapsed(stacks))
+        # names start with the time they were saved, so they sort oldest first
+        saved = sorted(f for f in os.listdir(self.profile_dir) if PROFILE_NAME.match(f))
+        for old in saved[: max(len(saved) - self.max_files, 0)]:
+            try:
+                os.remove(os.path.join(self.profile_dir, old))
+            except FileNotFoundError:
+                pass
+        return name
+
+
+def create_profiling_middleware(profiler: SamplingProfiler):
+    async def profiling_middleware(request: Request, call_next):
+        baggage = baggage_mgr.parse_headers(request.headers.getlist("baggage"))
+        if baggage.get(PROFILE_KEY) != "1":
+            return await call_next(request)
+        try:
+            with profiler.profile() as stacks:
+                response = await call_next(request)
+        except ProfilerBusy:
+            # profiling is best effort, never a reason to fail the request
+            return await call_next(request)
+        span = tracer.current_span()
+        trace_id = span.trace_id if span is not None else "request"
+        name = await run_in_threadpool(
+            profiler.save, f"{int(time.time() * 1000)}-{trace_id}.collapsed", stacks
+        )
+        response.headers[PROFILE_HEADER] = name
+        return response
+
+    return profiling_middleware
+
+
+def create_profile_endpoint(profiler: SamplingProfiler):
+    def profile(seconds: float = 10.0) -> PlainTextResponse:
+        """Profile whatever the service is doing for the next few seconds"""
+        try:
+            with profiler.profile() as stacks:
+                time.sleep(min(max(seconds, 0.0), MAX_PROFILE_SECONDS))
+        except ProfilerBusy:
+            raise HTTPException(status_code=409, detail="A profile is already running")
+        return PlainTextResponse(format_collapsed(stacks))
+
+    return profile
+
+
+def create_profile_download_endpoint(profiler: SamplingProfiler):
+    def get_profile(name: str) -> FileResponse:
+        path = os.path.join(profiler.profile_dir, name)
+        if not PROFILE_NAME.match(name) or not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return FileResponse(path, media_type="text/plain")
+
+    return get_profile
@@ -0,0 +1,159 @@
+import logging
+import os
+import shutil
+import threading
+from typing import Callable, Dict
+from fastapi import HTTPException, Request
+from .config import ServiceSettings
+
+logger = logging.getLogger(__name__)
+
+# a file in the data path naming the versioned subdirectory to serve from
+CURRENT_VERSION_FILE = "CURRENT"
+# the versions published to a data path, oldest first
+VERSION_HISTORY_FILE = "VERSIONS"
+# how many of the most recently published versions are kept on disk. the one
+# before the current version stays around to roll back to
+KEEP_DATA_VERSIONS = 2
+DATA_VERSION_HEADER = "X-Data-Version"
+HEALTH_PATH = "/health/"
+
+
+def read_data_version(data_path: str) -> str | None:
+    """
+    Returns the data version currently published in data_path, or None if the
+    data path isn't versioned and the data lives directly in it.
+    """
+    try:
+        with open(os.path.join(data_path, CURRENT_VERSION_FILE), "r") as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_atomically(path: str, data: str):
+    tmp_path = os.path.join(
+        os.path.dirname(path), f".{os.path.basename(path)}.{os.getpid()}"
+    )
+    with open(tmp_path, "w") as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+def publish_data_version(data_path: str, version: str, keep: int = KEEP_DATA_VERSIONS):
+    """
+    Atomically point data_path at the versioned subdirectory version, then
+    delete all but the keep most recently published versions
+    """
+    previous = read_data_version(data_path)
+    _write_atomically(os.path.join(data_path, CURRENT_VERSION_FILE), version)
+
+    history_path = os.path.join(data_path, VERSION_HISTORY_FILE)
+    try:
+        with open(history_path, "r") as file:
+            history = file.read().split()
+    except FileNotFoundError:
+        history = []
+    # a version published before there was a history still counts
+    if previous is not None and previous not in history:
+        history.append(previous)
+    history = [v for v in history if v != version] + [version]
+    retired, history = history[:-keep], history[-keep:]
+    _write_atomically(history_path, "\n".join(history) + "\n")
+    for old in retired:
+        # only ever delete a plain subdirectory of the data path
+        if old and old == os.path.basename(old) and not old.startswith("."):
+            logger.info("deleting data version %s", old)
+            shutil.rmtree(os.path.join(data_path, old), ignore_errors=True)
+
+
+def versioned_settings(settings: ServiceSettings, version: str | None):
+    if version is None:
+        return settings
+    return settings.model_copy(
+        update={"data_path": os.path.join(settings.data_path, version)}
+    )
+
+
+class DataReloader[T]:
+    """
+    Serves a service implementation loaded from the published data version,
+    and swaps in a new one when a new version is published.
+
+    Attribute access is forwarded to the current implementation, so handlers
+    call methods on the reloader as if it were the implementation. Each call
+    binds to whichever generation is current when it starts, so in-flight
+    requests finish on the old data while the new generation is loaded in
+    the background. At most two generations are alive at once.
+
+    Implementations can optionally have a ready threading.Event, set once
+    they're warmed up, and a close method. A new generation isn't swapped in
+    until it's ready, and a retired generation is closed once it's replaced.
+    """
+
+    def __init__(self, settings: ServiceSettings, load: Callable[[ServiceSettings], T]):
+        self._settings = settings
+        self._load = load
+        self._failed_version = None
+        version = read_data_version(settings.data_path)
+        # the version and the implementation are swapped together as a
+        # single reference so readers never see a mismatched pair
+        self._generation = (version, load(versioned_settings(settings, version)))
+        if settings.data_reload_interval > 0:
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+
+    @property
+    def data_version(self) -> str | None:
+        return self._generation[0]
+
+    def __getattr__(self, name: str):
+        return getattr(self._generation[1], name)
+
+    def reload(self) -> bool:
+        """Load and swap in the published version if it changed"""
+        version = read_data_version(self._settings.data_path)
+        if version is None or version in (self.data_version, self._failed_version):
+            return False
+        try:
+            impl = self._load(versioned_settings(self._settings, version))
+        except Exception:
+            # keep serving the current generation, and don't retry a broken
+            # version until another one is published
+            logger.exception("failed to load data version %s", version)
+            self._failed_version = version
+            return False
+        if (ready := getattr(impl, "ready", None)) is not None:
+            ready.wait()
+        retired = self._generation[1]
+        self._generation = (version, impl)
+        if (close := getattr(retired, "close", None)) is not None:
+            close()
+        logger.info("serving data version %s", version)
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self._settings.data_reload_interval):
+            self.reload()
+
+
+def create_data_version_middleware(reloader: DataReloader):
+    async def data_version_middleware(request: Request, call_next):
+        version = reloader.data_version
+        response = await call_next(request)
+        if version is not None:
+            response.headers[DATA_VERSION_HEADER] = version
+        return response
+
+    return data_version_middleware
+
+
+def create_health_endpoint(reloader: DataReloader):
+    def health() -> Dict[str, str | None]:
+        ready = getattr(reloader, "ready", None)
+        if ready is not None and not ready.is_set():
+            raise HTTPException(status_code=503, detail="Warming up")
+        return {"status": "ok", "data_version": reloader.data_version}
+
+    return health
@@ -0,0 +1,56 @@
+import threading
+from typing import Callable, Dict, Hashable
+from .metrics import metrics
+
+coalesced_calls = metrics.counter(
+    "wineinfo_singleflight_coalesced_total",
+    "Calls that waited for an identical call already in flight instead of "
+    "doing the work themselves",
+    ["name"],
+)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight[T]:
+    """
+    Coalesces concurrent calls with the same key, so only the first does the
+    work and the rest wait for and share its result, or its exception. Nothing
+    is kept once the call finishes, so callers arriving afterwards always do
+    the work again and never see a stale result.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            coalesced_calls.inc(name=self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
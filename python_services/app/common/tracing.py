@@ -0,0 +1,157 @@
+import json
+import logging
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Deque, Dict, Iterator, List, Protocol
+from fastapi import Request
+from .baggage import baggage_mgr
+
+# baggage keys carrying the trace, and the id of the caller's span
+TRACE_ID_KEY = "trace_id"
+PARENT_ID_KEY = "parent_id"
+TRACE_ID_HEADER = "X-Trace-Id"
+TRACES_PATH = "/traces/"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    service: str
+    name: str
+    kind: str
+    start: float
+    duration: float = 0.0
+    status: int | None = None
+
+
+class SpanSink(Protocol):
+    def emit(self, span: Span) -> None: ...
+
+
+class LogSpanSink:
+    def emit(self, span: Span) -> None:
+        logger.info(json.dumps(asdict(span)))
+
+
+class RingBufferSpanSink:
+    """Keeps the most recent spans in memory so they can be queried"""
+
+    def __init__(self, size: int):
+        self.spans: Deque[Span] = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def emit(self, span: Span) -> None:
+        with self.lock:
+            self.spans.append(span)
+
+    def get_trace(self, trace_id: str) -> List[Span]:
+        with self.lock:
+            return [span for span in self.spans if span.trace_id == trace_id]
+
+    def get_recent(self, limit: int) -> List[Span]:
+        with self.lock:
+            return list(self.spans)[-limit:]
+
+
+def create_span_sink(kind: str, size: int) -> SpanSink | None:
+    if kind == "log":
+        return LogSpanSink()
+    if kind == "ring":
+        return RingBufferSpanSink(size)
+    return None
+
+
+class Tracer:
+    def __init__(self):
+        self.service = ""
+        self.sink: SpanSink | None = None
+        self._current: ContextVar[Span | None] = ContextVar("span", default=None)
+
+    def configure(self, service: str, sink: SpanSink | None):
+        self.service = service
+        self.sink = sink
+
+    def current_span(self) -> Span | None:
+        return self._current.get()
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        kind: str,
+        trace_id: str | None = None,
+        parent_id: str | None = None,
+    ) -> Iterator[Span]:
+        """
+        Time the with block as a span. Spans are children of the current span
+        unless a trace and parent are given explicitly, and new traces are
+        started when there is neither.
+        """
+        if trace_id is None and (current := self.current_span()) is not None:
+            trace_id, parent_id = current.trace_id, current.span_id
+        span = Span(
+            trace_id=trace_id or secrets.token_hex(16),
+            span_id=secrets.token_hex(8),
+            parent_id=parent_id,
+            service=self.service,
+            name=name,
+            kind=kind,
+            start=time.time(),
+        )
+        # client spans are leaves, and aren't made current so a streaming
+        # call's span doesn't leak into the caller while it is suspended
+        token = self._current.set(span) if kind != "client" else None
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - start
+            if token is not None:
+                self._current.reset(token)
+            if self.sink is not None:
+                self.sink.emit(span)
+
+    def baggage(self, span: Span) -> Dict[str, str]:
+        """The baggage that makes a downstream call a child of span"""
+        return {TRACE_ID_KEY: span.trace_id, PARENT_ID_KEY: span.span_id}
+
+
+tracer = Tracer()
+
+
+def create_tracing_middleware():
+    async def tracing_middleware(request: Request, call_next):
+        # this can run before the baggage middleware, so parse the incoming
+        # baggage here rather than reading it from the baggage manager
+        baggage = baggage_mgr.parse_headers(request.headers.getlist("baggage"))
+        with tracer.span(
+            f"{request.method} {request.url.path}",
+            "server",
+            trace_id=baggage.get(TRACE_ID_KEY),
+            parent_id=baggage.get(PARENT_ID_KEY),
+        ) as span:
+            response = await call_next(request)
+            span.status = response.status_code
+        response.headers[TRACE_ID_HEADER] = span.trace_id
+        return response
+
+    return tracing_middleware
+
+
+def get_traces(trace_id: str | None = None, limit: int = 100) -> List[Dict]:
+    if not isinstance(tracer.sink, RingBufferSpanSink):
+        return []
+    if trace_id:
+        spans = tracer.sink.get_trace(trace_id)
+    else:
+        spans = tracer.sink.get_recent(limit)
+    return [asdict(span) for span in spans]
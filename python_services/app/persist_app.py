@@ -1,16 +1,84 @@
 from typing import List, Tuple
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
+from .common.artifact import install_artifact
 from .common.config import ServiceSettings
-from .common.api import SQLRequest, PERSIST_SERVICE
+from .common.api import (
+    CellarChanges,
+    CellarChangesRequest,
+    CellarRequest,
+    GetCellarRequest,
+    SQLRequest,
+    PERSIST_SERVICE,
+)
 from .common.baggage import create_baggage_middleware
+from .common.compression import create_compression_middleware
+from .common.deadline import create_deadline_middleware
+from .common.metrics import METRICS_PATH, create_metrics_middleware, metrics_endpoint
+from .common.profiling import (
+    PROFILE_PATH,
+    SamplingProfiler,
+    create_profile_download_endpoint,
+    create_profile_endpoint,
+    create_profiling_middleware,
+)
+from .common.tracing import (
+    TRACES_PATH,
+    create_span_sink,
+    create_tracing_middleware,
+    get_traces,
+    tracer,
+)
 from .services.persist_service_impl import PersistServiceImpl
 
-impl = PersistServiceImpl(ServiceSettings())
+settings = ServiceSettings()
+if settings.data_artifact:
+    install_artifact(settings.data_artifact, settings.data_path)
+impl = PersistServiceImpl(settings)
 app = FastAPI()
 app.middleware("http")(create_baggage_middleware())
+app.middleware("http")(create_deadline_middleware())
+app.middleware("http")(
+    create_compression_middleware(
+        settings.compression_minimum_size, settings.compression_level
+    )
+)
+app.middleware("http")(create_metrics_middleware())
+app.get(METRICS_PATH)(metrics_endpoint)
+if settings.profiling_enabled:
+    profiler = SamplingProfiler(
+        settings.profile_dir, settings.profile_interval, settings.profile_max_files
+    )
+    app.middleware("http")(create_profiling_middleware(profiler))
+    app.get(PROFILE_PATH)(create_profile_endpoint(profiler))
+    app.get(PROFILE_PATH + "{name}")(create_profile_download_endpoint(profiler))
+tracer.configure(
+    "persist", create_span_sink(settings.trace_sink, settings.trace_buffer_size)
+)
+app.middleware("http")(create_tracing_middleware())
+app.get(TRACES_PATH)(get_traces)
 
 @app.post(PERSIST_SERVICE["do_sql"]["path"])
 def do_sql(
     params: SQLRequest
 ) -> List[Tuple]:
     return impl.do_sql(params)
+
+
+@app.post(PERSIST_SERVICE["add_to_cellar"]["path"])
+def add_to_cellar(params: CellarRequest) -> None:
+    impl.add_to_cellar(params)
+
+
+@app.post(PERSIST_SERVICE["remove_from_cellar"]["path"])
+def remove_from_cellar(params: CellarRequest) -> None:
+    impl.remove_from_cellar(params)
+
+
+@app.get(PERSIST_SERVICE["get_cellar"]["path"])
+def get_cellar(params: GetCellarRequest = Depends()) -> List[int]:
+    return impl.get_cellar(params)
+
+
+@app.get(PERSIST_SERVICE["get_cellar_changes"]["path"])
+def get_cellar_changes(params: CellarChangesRequest = Depends()) -> CellarChanges:
+    return impl.get_cellar_changes(params)
@@ -1,24 +1,151 @@
+import atexit
+import os
 from typing import List
 from fastapi import Depends, FastAPI
 from .common.http_client import HttpClient
+from .common.artifact import install_artifact
 from .common.config import ServiceSettings
-from .common.api import RecsRequest, RECS_SERVICE
-from .common.api_stubs import CatalogService
+from .common.api import CellarRecsRequest, RecsRequest, RECS_SERVICE
+from .common.api_stubs import CachingCatalogService, CatalogService, PersistService
 from .common.baggage import create_baggage_middleware
+from .common.cache import VersionedCache
+from .common.compression import create_compression_middleware
+from .common.concurrency import AdaptiveLimiter, create_concurrency_middleware
+from .common.deadline import create_deadline_middleware
+from .common.metrics import METRICS_PATH, create_metrics_middleware, metrics_endpoint
+from .common.profiling import (
+    PROFILE_PATH,
+    SamplingProfiler,
+    create_profile_download_endpoint,
+    create_profile_endpoint,
+    create_profiling_middleware,
+)
+from .common.tracing import (
+    TRACES_PATH,
+    create_span_sink,
+    create_tracing_middleware,
+    get_traces,
+    tracer,
+)
+from .common.reloader import (
+    HEALTH_PATH,
+    DataReloader,
+    create_data_version_middleware,
+    create_health_endpoint,
+)
+from .services.cooccurrence import CooccurrenceModel, sync_cellar_changes
+from .services.hot_queries import HotQueries
 from .services.recs_service_impl import RecsServiceImpl
 
 
 settings = ServiceSettings()
-catalog_service = CatalogService(
-    HttpClient(settings.catalog_service, settings.use_junction)
+if settings.data_artifact:
+    install_artifact(settings.data_artifact, settings.data_path)
+catalog_client = HttpClient(
+    settings.catalog_service,
+    settings.use_junction,
+    timeout=settings.client_timeout,
+    retries=settings.client_retries,
+    hedge=settings.client_hedge,
 )
-impl = RecsServiceImpl(ServiceSettings(), False, catalog_service)
-# the LLM may not be downloaded until we do this, so do it now
-impl.get_recommendations_unfiltered(RecsRequest(query="dummy", limit=1))
+if settings.catalog_cache_size > 0:
+    catalog_service = CachingCatalogService(
+        catalog_client,
+        VersionedCache(
+            "catalog",
+            catalog_client,
+            settings.catalog_cache_size,
+            settings.catalog_cache_revalidate_interval,
+        ),
+    )
+else:
+    catalog_service = CatalogService(catalog_client)
+
+# kept beside the data versions, so it outlives reloads as well as restarts
+hot_queries = None
+if settings.recs_hot_queries_file:
+    hot_queries = HotQueries(
+        os.path.join(settings.data_path, settings.recs_hot_queries_file),
+        settings.recs_prewarm_queries,
+    )
+    hot_queries.save_every(settings.recs_hot_queries_save_interval)
+    atexit.register(hot_queries.save)
+
+# cellars live in persist rather than in the data versions, so the model is
+# shared by every generation
+cooccurrence = None
+if settings.recs_cellar_sync_interval > 0:
+    cooccurrence = CooccurrenceModel(settings.recs_cellar_neighbors)
+    sync_cellar_changes(
+        cooccurrence,
+        PersistService(
+            HttpClient(
+                settings.persist_service,
+                settings.use_junction,
+                timeout=settings.client_timeout,
+                retries=settings.client_retries,
+            )
+        ),
+        settings.recs_cellar_sync_interval,
+        settings.recs_cellar_sync_batch_size,
+    )
+
+
+def load_recs_service(settings: ServiceSettings) -> RecsServiceImpl:
+    recs_service = RecsServiceImpl(
+        settings,
+        False,
+        catalog_service,
+        hot_queries=hot_queries,
+        cooccurrence=cooccurrence,
+    )
+    # the LLM may not be downloaded until we do this, so do it now
+    recs_service.get_recommendations_unfiltered(RecsRequest(query="dummy", limit=1))
+    recs_service.prewarm(settings.recs_prewarm_queries)
+    return recs_service
+
+
+impl = DataReloader(settings, load_recs_service)
 app = FastAPI()
 app.middleware("http")(create_baggage_middleware())
+app.middleware("http")(create_deadline_middleware())
+if settings.recs_concurrency_limit:
+    limiter = AdaptiveLimiter(
+        settings.concurrency_initial_limit,
+        settings.concurrency_min_limit,
+        settings.concurrency_max_limit,
+        settings.concurrency_max_queue,
+        settings.concurrency_target_queue_delay,
+    )
+    app.middleware("http")(create_concurrency_middleware(limiter))
+app.middleware("http")(
+    create_compression_middleware(
+        settings.compression_minimum_size, settings.compression_level
+    )
+)
+app.middleware("http")(create_metrics_middleware())
+app.get(METRICS_PATH)(metrics_endpoint)
+if settings.profiling_enabled:
+    profiler = SamplingProfiler(
+        settings.profile_dir, settings.profile_interval, settings.profile_max_files
+    )
+    app.middleware("http")(create_profiling_middleware(profiler))
+    app.get(PROFILE_PATH)(create_profile_endpoint(profiler))
+    app.get(PROFILE_PATH + "{name}")(create_profile_download_endpoint(profiler))
+tracer.configure(
+    "recs", create_span_sink(settings.trace_sink, settings.trace_buffer_size)
+)
+app.middleware("http")(create_tracing_middleware())
+app.get(TRACES_PATH)(get_traces)
+app.middleware("http")(create_data_version_middleware(impl))
+app.get(HEALTH_PATH)(create_health_endpoint(impl))
 
 
 @app.get(RECS_SERVICE["get_recommendations"]["path"])
 def get_recommendations(params: RecsRequest = Depends()) -> List[int]:
     return impl.get_recommendations(params)
+
+
+@app.get(RECS_SERVICE["get_cellar_recommendations"]["path"])
+def get_cellar_recommendations(params: CellarRecsRequest = Depends()) -> List[int]:
+    return impl.get_cellar_recommendations(params)
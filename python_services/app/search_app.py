@@ -1,13 +1,67 @@
-from typing import Annotated
+from typing import Annotated, List
 from fastapi import FastAPI, Query
 from .common.baggage import create_baggage_middleware
+from .common.compression import create_compression_middleware
+from .common.deadline import create_deadline_middleware
+from .common.metrics import METRICS_PATH, create_metrics_middleware, metrics_endpoint
+from .common.profiling import (
+    PROFILE_PATH,
+    SamplingProfiler,
+    create_profile_download_endpoint,
+    create_profile_endpoint,
+    create_profiling_middleware,
+)
+from .common.tracing import (
+    TRACES_PATH,
+    create_span_sink,
+    create_tracing_middleware,
+    get_traces,
+    tracer,
+)
+from .common.artifact import install_artifact
 from .common.config import ServiceSettings
-from .common.api import SearchRequest, PaginatedList, SEARCH_SERVICE
+from .common.reloader import (
+    HEALTH_PATH,
+    DataReloader,
+    create_data_version_middleware,
+    create_health_endpoint,
+)
+from .common.api import (
+    AutocompleteRequest,
+    SearchRequest,
+    PaginatedList,
+    SEARCH_SERVICE,
+)
 from .services.search_service_impl import SearchServiceImpl
 
-impl = SearchServiceImpl(ServiceSettings())
+settings = ServiceSettings()
+if settings.data_artifact:
+    install_artifact(settings.data_artifact, settings.data_path)
+impl = DataReloader(settings, SearchServiceImpl)
 app = FastAPI()
 app.middleware("http")(create_baggage_middleware())
+app.middleware("http")(create_deadline_middleware())
+app.middleware("http")(
+    create_compression_middleware(
+        settings.compression_minimum_size, settings.compression_level
+    )
+)
+app.middleware("http")(create_metrics_middleware())
+app.get(METRICS_PATH)(metrics_endpoint)
+if settings.profiling_enabled:
+    profiler = SamplingProfiler(
+        settings.profile_dir, settings.profile_interval, settings.profile_max_files
+    )
+    app.middleware("http")(create_profiling_middleware(profiler))
+    app.get(PROFILE_PATH)(create_profile_endpoint(profiler))
+    app.get(PROFILE_PATH + "{name}")(create_profile_download_endpoint(profiler))
+tracer.configure(
+    "search", create_span_sink(settings.trace_sink, settings.trace_buffer_size)
+)
+app.middleware("http")(create_tracing_middleware())
+app.get(TRACES_PATH)(get_traces)
+app.middleware("http")(create_data_version_middleware(impl))
+app.get(HEALTH_PATH)(create_health_endpoint(impl))
 
 
 @app.get(SEARCH_SERVICE["search"]["path"])
@@ -15,3 +69,10 @@ def search(
     params: Annotated[SearchRequest, Query()],
 ) -> PaginatedList[int]:
     return impl.search(params)
+
+
+@app.get(SEARCH_SERVICE["autocomplete"]["path"])
+async def autocomplete(
+    params: Annotated[AutocompleteRequest, Query()],
+) -> List[str]:
+    return impl.autocomplete(params)
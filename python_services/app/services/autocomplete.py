@@ -0,0 +1,122 @@
+import heapq
+import json
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+# the most completions a single request can return. every precomputed prefix
+# keeps exactly this many candidates.
+MAX_COMPLETIONS = 20
+# prefixes matching more entries than this get their top completions
+# precomputed at build time, anything narrower is answered by scanning the
+# matching slice of the sorted keys.
+SCAN_LIMIT = 256
+
+
+def normalize(text: str) -> str:
+    """Lowercase and strip accents so that "rose" completes to "Rosé"."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.split())
+
+
+class AutocompleteIndex:
+    """
+    A prefix index over wine titles, wineries, varieties and regions.
+
+    Entries are kept in arrays sorted by their normalized key, so every prefix
+    maps to a contiguous slice. Broad prefixes have their best completions
+    precomputed by popularity, so a lookup is at most a dict hit or a bisect
+    plus a scan of SCAN_LIMIT entries.
+    """
+
+    def __init__(
+        self,
+        keys: List[str],
+        texts: List[str],
+        weights: List[int],
+        top: Dict[str, List[int]],
+    ):
+        self.keys = keys
+        self.texts = texts
+        self.weights = weights
+        self.top = top
+
+    @classmethod
+    def build(cls, counts: Counter) -> "AutocompleteIndex":
+        # collapse strings that only differ by case or accents, displaying
+        # the most common spelling
+        weights_by_key: Dict[str, int] = defaultdict(int)
+        text_by_key: Dict[str, str] = {}
+        for text, count in counts.most_common():
+            key = normalize(text)
+            if not key:
+                continue
+            weights_by_key[key] += count
+            text_by_key.setdefault(key, text)
+
+        keys = sorted(weights_by_key)
+        texts = [text_by_key[key] for key in keys]
+        weights = [weights_by_key[key] for key in keys]
+
+        top: Dict[str, List[int]] = {}
+        narrow = set()
+        for key in keys:
+            for end in range(1, len(key) + 1):
+                prefix = key[:end]
+                if prefix in narrow:
+                    break
+                if prefix in top:
+                    continue
+                lo, hi = _prefix_range(keys, prefix)
+                if hi - lo <= SCAN_LIMIT:
+                    narrow.add(prefix)
+                    break
+                top[prefix] = _best(weights, lo, hi, MAX_COMPLETIONS)
+
+        return cls(keys, texts, weights, top)
+
+    @classmethod
+    def empty(cls) -> "AutocompleteIndex":
+        return cls([], [], [], {})
+
+    @classmethod
+    def load(cls, path: str) -> "AutocompleteIndex":
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        return cls(data["keys"], data["texts"], data["weights"], data["top"])
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "keys": self.keys,
+                    "texts": self.texts,
+                    "weights": self.weights,
+                    "top": self.top,
+                },
+                file,
+                ensure_ascii=False,
+            )
+
+    def complete(self, prefix: str, limit: int) -> List[str]:
+        key = normalize(prefix)
+        limit = min(limit, MAX_COMPLETIONS)
+        if not key or limit <= 0:
+            return []
+        if key in self.top:
+            indexes = self.top[key][:limit]
+        else:
+            lo, hi = _prefix_range(self.keys, key)
+            indexes = _best(self.weights, lo, hi, limit)
+        return [self.texts[i] for i in indexes]
+
+
+def _prefix_range(keys: List[str], prefix: str) -> tuple[int, int]:
+    return bisect_left(keys, prefix), bisect_left(keys, prefix + "\U0010ffff")
+
+
+def _best(weights: List[int], lo: int, hi: int, limit: int) -> List[int]:
+    # ties go to the alphabetically first entry, which has the lower index
+    return heapq.nsmallest(limit, range(lo, hi), key=lambda i: (-weights[i], i))
@@ -0,0 +1,137 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import Dict, List, Sequence
+from ..common.api import BrowseWinesRequest, Wine
+
+POSTING_FIELDS = ("country", "variety", "winery")
+
+
+def _parse_number(value: str) -> float | None:
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _sort_key(values: List[float | None], descending: bool):
+    # ties are always broken by ascending id
+    if descending:
+        return lambda i: (-values[i], i)
+    return lambda i: (values[i], i)
+
+
+class SortedIndex:
+    """Wine ids ordered by a numeric field, with wines missing it kept apart."""
+
+    def __init__(self, values: List[float | None]):
+        present = [i for i, value in enumerate(values) if value is not None]
+        missing = [i for i, value in enumerate(values) if value is None]
+        self.ids = sorted(present, key=_sort_key(values, False))
+        self.keys = [values[i] for i in self.ids]
+        # wines without a value sort last in either direction
+        self.ascending = self.ids + missing
+        self.descending = sorted(present, key=_sort_key(values, True)) + missing
+
+    def range(self, low: float | None, high: float | None) -> Sequence[int]:
+        lo = 0 if low is None else bisect_left(self.keys, low)
+        hi = len(self.keys) if high is None else bisect_right(self.keys, high)
+        return self.ids[lo:hi]
+
+
+class CatalogIndex:
+    """
+    Secondary indexes over the catalog: sorted posting lists of wine ids for
+    exact matches on country, variety and winery, and wine ids sorted by
+    points and price for range filters and ordering.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, List[int]]] = {
+            field: defaultdict(list) for field in POSTING_FIELDS
+        }
+        self.points: List[float | None] = []
+        self.prices: List[float | None] = []
+
+    def add_wine(self, wine: Wine):
+        # ids are assigned in increasing order, so appending keeps every
+        # posting list sorted
+        for field in POSTING_FIELDS:
+            value = getattr(wine, field)
+            if value:
+                self.postings[field][value.casefold()].append(wine.id)
+        self.points.append(_parse_number(wine.points))
+        self.prices.append(_parse_number(wine.price))
+
+    def build(self):
+        self.by_points = SortedIndex(self.points)
+        self.by_price = SortedIndex(self.prices)
+
+    def browse(self, params: BrowseWinesRequest) -> Sequence[int]:
+        """Returns the ids of every wine matching params, in sorted order"""
+        postings: List[List[int]] = []
+        for field in POSTING_FIELDS:
+            value = getattr(params, field)
+            if value is not None:
+                postings.append(self.postings[field].get(value.casefold(), []))
+
+        ranges: List[Sequence[int]] = []
+        has_points_range = (
+            params.min_points is not None or params.max_points is not None
+        )
+        has_price_range = params.min_price is not None or params.max_price is not None
+        if has_points_range:
+            ranges.append(self.by_points.range(params.min_points, params.max_points))
+        if has_price_range:
+            ranges.append(self.by_price.range(params.min_price, params.max_price))
+
+        if not postings and not ranges:
+            return self._ordered(params)
+
+        # drive the intersection from the smallest candidate list and check
+        # every other condition per candidate: a bisect into the other sorted
+        # posting lists, or a comparison against the numeric columns
+        driver = min(postings + ranges, key=len)
+        ids = [
+            i
+            for i in driver
+            if all(p is driver or _contains(p, i) for p in postings)
+            and (
+                not has_points_range
+                or self._in_range(self.points[i], params.min_points, params.max_points)
+            )
+            and (
+                not has_price_range
+                or self._in_range(self.prices[i], params.min_price, params.max_price)
+            )
+        ]
+
+        if params.sort_by == "id":
+            if not any(driver is posting for posting in postings):
+                ids.sort()
+            return ids[::-1] if params.descending else ids
+        values = self.points if params.sort_by == "points" else self.prices
+        present = sorted(
+            (i for i in ids if values[i] is not None),
+            key=_sort_key(values, params.descending),
+        )
+        return present + sorted(i for i in ids if values[i] is None)
+
+    def _ordered(self, params: BrowseWinesRequest) -> Sequence[int]:
+        if params.sort_by == "id":
+            ids = range(len(self.points))
+            return ids[::-1] if params.descending else ids
+        index = self.by_points if params.sort_by == "points" else self.by_price
+        return index.descending if params.descending else index.ascending
+
+    @staticmethod
+    def _in_range(value: float | None, low: float | None, high: float | None):
+        return (
+            value is not None
+            and (low is None or value >= low)
+            and (high is None or value <= high)
+        )
+
+
+def _contains(posting: List[int], wine_id: int) -> bool:
+    i = bisect_left(posting, wine_id)
+    return i < len(posting) and posting[i] == wine_id
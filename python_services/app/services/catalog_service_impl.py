@@ -1,15 +1,19 @@
 import csv
 import os
-from typing import List
+from bisect import bisect_left
+from typing import Iterator, List
 from fastapi import HTTPException
 from typing import List
 from ..common.config import ServiceSettings
-from ..common.api import PaginatedList, Wine
+from ..common.cursor import decode_cursor, encode_cursor
+from ..common.api import BrowseWinesRequest, ExportWinesRequest, PaginatedList, Wine
+from .catalog_index import CatalogIndex
 
 
 class CatalogServiceImpl:
     def __init__(self, settings: ServiceSettings, reset: bool = False):
         self.data: List[Wine] = []
+        self.index = CatalogIndex()
         self.file_name = os.path.join(settings.data_path, "catalog_data.csv")
         if not reset:
             with open(self.file_name, "r", encoding="utf-8") as file:
@@ -19,10 +23,12 @@ class CatalogServiceImpl:
                     if settings.catalog_demo_mojibake:
                         row["title"] = row["title"].encode("utf-8").decode("iso-8859-1")
                     self.add_wine(Wine.model_validate(row))
+            self.index.build()
 
     def add_wine(self, wine: Wine) -> Wine:
         wine.id = len(self.data)
         self.data.append(wine)
+        self.index.add_wine(wine)
         return wine
 
     def get_wine(self, ids: List[int]) -> List[Wine]:
@@ -42,13 +48,55 @@ class CatalogServiceImpl:
 
         return wines
 
-    def get_all_wines_paginated(self, page: int, page_size: int) -> PaginatedList[Wine]:
-        offset = (page - 1) * page_size
+    def get_all_wines_paginated(
+        self, page: int, page_size: int, cursor: str | None = None
+    ) -> PaginatedList[Wine]:
+        if cursor:
+            # wine ids are positions in the catalog, so resuming after the
+            # last id returned is a constant time slice
+            try:
+                last_id = int(decode_cursor(cursor)["id"])
+            except (KeyError, TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            if last_id < 0:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            offset = last_id + 1
+        else:
+            offset = (page - 1) * page_size
         paginated_wines = self.data[offset : offset + page_size]
+        next_cursor = None
+        if offset + page_size < len(self.data) and paginated_wines:
+            next_cursor = encode_cursor({"id": paginated_wines[-1].id})
         return PaginatedList[Wine](
             items=paginated_wines,
             total=len(self.data),
             page=page,
             page_size=page_size,
             total_pages=(len(self.data) + page_size - 1) // page_size,
+            next_cursor=next_cursor,
+        )
+
+    def browse_wines(self, params: BrowseWinesRequest) -> PaginatedList[Wine]:
+        ids = self.index.browse(params)
+        offset = (params.page - 1) * params.page_size
+        return PaginatedList[Wine](
+            items=[self.data[i] for i in ids[offset : offset + params.page_size]],
+            total=len(ids),
+            page=params.page,
+            page_size=params.page_size,
+            total_pages=(len(ids) + params.page_size - 1) // params.page_size,
+        )
+
+    def export_wines(self, params: ExportWinesRequest) -> Iterator[Wine]:
+        ids = self.index.browse(
+            BrowseWinesRequest(
+                country=params.country,
+                variety=params.variety,
+                winery=params.winery,
+            )
         )
+        # ids come back sorted, so the requested range is a contiguous slice
+        lo = bisect_left(ids, params.start_id)
+        hi = len(ids) if params.end_id is None else bisect_left(ids, params.end_id)
+        for i in ids[lo:hi]:
+            yield self.data[i]
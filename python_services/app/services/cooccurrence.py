@@ -0,0 +1,161 @@
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+import requests
+from ..common.api import CellarChange, CellarChangesRequest
+
+logger = logging.getLogger(__name__)
+
+
+class CooccurrenceModel:
+    """
+    Item to item recommendations from what users keep in their cellars.
+
+    A sparse matrix counts, for every pair of wines, how many users have both
+    in their cellar, and each wine keeps its top_k most co-occurring wines.
+    Neighbors are ranked by the share of a wine's users who also have the
+    neighbor, which for one wine only depends on the pair counts, so a cellar
+    change only has to re-rank the wines in that user's cellar.
+    """
+
+    def __init__(self, top_k: int):
+        self.top_k = top_k
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything, to rebuild from the start of the cellar changes"""
+        # user -> wine -> copies in their cellar, since nothing stops a user
+        # adding the same wine twice
+        self.cellars: Dict[int, Dict[int, int]] = defaultdict(dict)
+        # wine -> how many users have it
+        self.wine_users: Dict[int, int] = defaultdict(int)
+        # wine -> other wine -> how many users have both
+        self.cooccurrences: Dict[int, Dict[int, int]] = defaultdict(dict)
+        self.neighbors: Dict[int, List[Tuple[int, int]]] = {}
+        # where to resume reading cellar changes from
+        self.cursor: str | None = None
+
+    def apply(self, changes: Iterable[CellarChange], cursor: str):
+        with self.lock:
+            dirty: Set[int] = set()
+            for change in changes:
+                if change.added:
+                    self._add(change.user_id, change.wine_id, dirty)
+                else:
+                    self._remove(change.user_id, change.wine_id, dirty)
+            for wine in dirty:
+                self._rank(wine)
+            self.cursor = cursor
+
+    def _add(self, user_id: int, wine_id: int, dirty: Set[int]):
+        cellar = self.cellars[user_id]
+        copies = cellar.get(wine_id, 0)
+        cellar[wine_id] = copies + 1
+        if copies > 0:
+            return
+        self.wine_users[wine_id] += 1
+        for other in cellar:
+            if other != wine_id:
+                self._count(wine_id, other, 1)
+                dirty.add(other)
+        dirty.add(wine_id)
+
+    def _remove(self, user_id: int, wine_id: int, dirty: Set[int]):
+        cellar = self.cellars.get(user_id)
+        if cellar is None or wine_id not in cellar:
+            return
+        cellar[wine_id] -= 1
+        if cellar[wine_id] > 0:
+            return
+        del cellar[wine_id]
+        if not cellar:
+            del self.cellars[user_id]
+        self.wine_users[wine_id] -= 1
+        if self.wine_users[wine_id] == 0:
+            del self.wine_users[wine_id]
+        for other in cellar:
+            self._count(wine_id, other, -1)
+            dirty.add(other)
+        dirty.add(wine_id)
+
+    def _count(self, a: int, b: int, delta: int):
+        for x, y in ((a, b), (b, a)):
+            row = self.cooccurrences[x]
+            row[y] = row.get(y, 0) + delta
+            if row[y] == 0:
+                del row[y]
+                if not row:
+                    del self.cooccurrences[x]
+
+    def _rank(self, wine_id: int):
+        row = self.cooccurrences.get(wine_id)
+        if not row:
+            self.neighbors.pop(wine_id, None)
+            return
+        self.neighbors[wine_id] = heapq.nlargest(
+            self.top_k, row.items(), key=lambda item: (item[1], -item[0])
+        )
+
+    def recommend(
+        self, user_id: int | None, wine_id: int | None, limit: int
+    ) -> List[int]:
+        """
+        Wines that the users who have wine_id, or the wines in user_id's
+        cellar, also have, leaving out the ones the user already has
+        """
+        with self.lock:
+            seeds = set(self.cellars.get(user_id, ()))
+            exclude = set(seeds)
+            if wine_id is not None:
+                seeds.add(wine_id)
+                exclude.add(wine_id)
+            scores: Dict[int, float] = defaultdict(float)
+            for seed in seeds:
+                users = self.wine_users.get(seed)
+                for neighbor, count in self.neighbors.get(seed, ()):
+                    if neighbor not in exclude:
+                        scores[neighbor] += count / users
+        top = heapq.nlargest(
+            limit, scores.items(), key=lambda item: (item[1], -item[0])
+        )
+        return [wine for wine, _ in top]
+
+
+def sync_cellar_changes(
+    model: CooccurrenceModel, persist_service, interval: float, batch_size: int
+) -> threading.Event:
+    """
+    Keep model up to date with the cellar changes from persist, polling every
+    interval seconds in the background until the returned event is set
+    """
+    stop = threading.Event()
+
+    def run():
+        while True:
+            try:
+                while True:
+                    changes = persist_service.get_cellar_changes(
+                        CellarChangesRequest(cursor=model.cursor, limit=batch_size)
+                    )
+                    model.apply(changes.changes, changes.cursor)
+                    if len(changes.changes) < batch_size:
+                        break
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 410:
+                    # persist was rebalanced, so its change logs were rebuilt
+                    logger.info("cellar changes restarted, rebuilding")
+                    with model.lock:
+                        model.reset()
+                    continue
+                logger.exception("failed to sync cellar changes")
+            except Exception:
+                # persist being away only makes the recommendations stale
+                logger.exception("failed to sync cellar changes")
+            if stop.wait(interval):
+                return
+
+    threading.Thread(target=run, daemon=True).start()
+    return stop
@@ -1,34 +1,375 @@
+import glob
+import hashlib
 import os
-from contextlib import closing
+import queue
 import sqlite3
-from typing import List, Tuple
+import threading
+import uuid
+from contextlib import closing, contextmanager, nullcontext
+from typing import Iterator, List, Tuple
+from fastapi import HTTPException
 from ..common.config import ServiceSettings
-from ..common.api import SQLRequest
+from ..common.api import (
+    CellarChange,
+    CellarChanges,
+    CellarChangesRequest,
+    CellarRequest,
+    GetCellarRequest,
+    SQLRequest,
+)
+from ..common.cursor import decode_cursor, encode_cursor
+from ..common.metrics import timed
 
+DB_FILE = "persist_data.db"
+# the most cellar changes returned by one get_cellar_changes call
+MAX_CELLAR_CHANGES = 10000
+# seconds to wait for another connection's write lock before failing
+BUSY_TIMEOUT = 30.0
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS cellar (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        wine_id INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS cellar_user_id ON cellar (user_id)",
+    # every change to the cellar table is logged by triggers, so they're
+    # captured however the cellar is written to
+    """
+    CREATE TABLE IF NOT EXISTS cellar_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        wine_id INTEGER NOT NULL,
+        added INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cellar_log_insert AFTER INSERT ON cellar
+    BEGIN
+        INSERT INTO cellar_log (user_id, wine_id, added)
+        VALUES (NEW.user_id, NEW.wine_id, 1);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cellar_log_delete AFTER DELETE ON cellar
+    BEGIN
+        INSERT INTO cellar_log (user_id, wine_id, added)
+        VALUES (OLD.user_id, OLD.wine_id, 0);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cellar_log_update
+    AFTER UPDATE OF user_id, wine_id ON cellar
+    BEGIN
+        INSERT INTO cellar_log (user_id, wine_id, added)
+        VALUES (OLD.user_id, OLD.wine_id, 0), (NEW.user_id, NEW.wine_id, 1);
+    END
+    """,
+    # which shard of which set of shards the database is. the layout id names
+    # its change log, and is empty until persist first serves from it
+    """
+    CREATE TABLE IF NOT EXISTS shard_layout (
+        layout TEXT NOT NULL,
+        shard INTEGER NOT NULL,
+        shards INTEGER NOT NULL
+    )
+    """,
+]
 
-class PersistServiceImpl:
-    def __init__(self, settings: ServiceSettings, reset: bool = False):
-        self.db_path = os.path.join(settings.data_path, "persist_data.db")
+
+class ShardLayoutError(Exception):
+    pass
+
+
+def shard_paths(data_path: str, shards: int) -> List[str]:
+    """The database files of each shard, a single shard uses the original file"""
+    if shards == 1:
+        return [os.path.join(data_path, DB_FILE)]
+    name, ext = os.path.splitext(DB_FILE)
+    return [
+        os.path.join(data_path, f"{name}.{shard}-of-{shards}{ext}")
+        for shard in range(shards)
+    ]
+
+
+def shard_for(user_id: int | str, shards: int) -> int:
+    """The shard holding a user's data, the same in every process"""
+    digest = hashlib.blake2b(str(user_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % shards
+
+
+def new_layout() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def init_shard(
+    path: str,
+    layout: str | None,
+    shard: int,
+    shards: int,
+    reset: bool = False,
+) -> str:
+    """
+    Create whatever's missing of the schema in a shard database, returning
+    the layout it belongs to. A database without one yet gets layout, or
+    stays without one if layout is None. reset drops everything first.
+    """
+    with closing(sqlite3.connect(path, isolation_level=None)) as conn:
+        conn.execute("BEGIN IMMEDIATE")
         if reset:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("DROP TABLE IF EXISTS cellar")
-            cursor.execute(
+            for table in ("cellar", "cellar_log", "shard_layout"):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+        tables = {
+            name
+            for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+        for statement in SCHEMA:
+            conn.execute(statement)
+        if "cellar" in tables and "cellar_log" not in tables:
+            # a database from before the log existed starts it off with
+            # everything already in the cellar
+            conn.execute(
                 """
-                CREATE TABLE cellar (
-                    id INTEGER PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    wine_id INTEGER NOT NULL
-                )
+                INSERT INTO cellar_log (user_id, wine_id, added)
+                SELECT user_id, wine_id, 1 FROM cellar ORDER BY id
                 """
             )
-            conn.commit()
-            conn.close
+        row = conn.execute("SELECT layout, shard, shards FROM shard_layout").fetchone()
+        if row is None:
+            row = ("", shard, shards)
+            conn.execute("INSERT INTO shard_layout VALUES (?, ?, ?)", row)
+        if not row[0] and layout and tuple(row[1:]) == (shard, shards):
+            row = (layout, shard, shards)
+            conn.execute("UPDATE shard_layout SET layout = ?", (layout,))
+        conn.execute("COMMIT")
+    if tuple(row[1:]) != (shard, shards):
+        raise ShardLayoutError(
+            f"{path} is shard {row[1]} of {row[2]}, not {shard} of {shards}"
+        )
+    return row[0]
 
-    def do_sql(self, params: SQLRequest) -> List[Tuple]:
-        with sqlite3.connect(self.db_path) as conn:
-            with closing(conn.cursor()) as cursor:
-                cursor.execute(params.query, params.params)
-                ret = cursor.fetchall()
+
+def has_cellar_rows(path: str) -> bool:
+    with closing(sqlite3.connect(path)) as conn:
+        try:
+            return conn.execute("SELECT 1 FROM cellar LIMIT 1").fetchone() is not None
+        except sqlite3.OperationalError:
+            return False
+
+
+class Shard:
+    """One shard's database, with a pool of at most pool_size connections"""
+
+    def __init__(self, path: str, pool_size: int):
+        self.path = path
+        self.pool_size = pool_size
+        self.pool: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self.connections = 0
+        self.lock = threading.Lock()
+        # sqlite lets one connection write at a time and makes the others
+        # sleep and retry, so writers queue here instead
+        self.write_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        # readers don't block the writer, or each other
+        conn.execute("PRAGMA journal_mode = WAL")
+        return conn
+
+    def _get(self) -> sqlite3.Connection:
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            create = self.connections < self.pool_size
+            if create:
+                self.connections += 1
+        if not create:
+            return self.pool.get()
+        try:
+            return self._connect()
+        except BaseException:
+            with self.lock:
+                self.connections -= 1
+            raise
+
+    @contextmanager
+    def connection(self, write: bool = False) -> Iterator[sqlite3.Connection]:
+        # writers queue before taking a connection, so the pool isn't used up
+        # by writers waiting their turn while readers have none
+        with self.write_lock if write else nullcontext():
+            conn = self._get()
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self.pool.put(conn)
+
+
+class PersistServiceImpl:
+    """
+    User data, split across settings.persist_shards SQLite databases by a
+    hash of user_id so writes for different users don't queue behind one
+    file lock. Changing the number of shards needs the data moving with
+    bin/rebalance_persist.py first.
+    """
+
+    def __init__(self, settings: ServiceSettings, reset: bool = False):
+        shards = settings.persist_shards
+        paths = shard_paths(settings.data_path, shards)
+        if not reset and not all(os.path.exists(path) for path in paths):
+            other_layouts = [
+                path
+                for path in glob.glob(os.path.join(settings.data_path, "*.db"))
+                if path not in paths and has_cellar_rows(path)
+            ]
+            if other_layouts:
+                raise ShardLayoutError(
+                    f"{', '.join(other_layouts)} hold cellar data for a different "
+                    f"number of shards than {shards}, move it with "
+                    "bin/rebalance_persist.py"
+                )
+
+        # a database gets its layout the first time persist serves from it,
+        # never when it's built. one restored from an image or a backup then
+        # starts a new change log, instead of continuing under the id that
+        # readers of the old log still have cursors for
+        layout = None if reset else new_layout()
+        layouts = set()
+        for shard, path in enumerate(paths):
+            layouts.add(init_shard(path, layout, shard, shards, reset))
+        if len(layouts) > 1:
+            raise ShardLayoutError(f"shards {paths} are from different layouts")
+        self.layout = layouts.pop()
+        self.shards = [Shard(path, settings.persist_pool_size) for path in paths]
+
+    def _shard(self, user_id: int | str) -> Shard:
+        return self.shards[shard_for(user_id, len(self.shards))]
+
+    def add_to_cellar(self, params: CellarRequest):
+        with self._shard(params.user_id).connection(write=True) as conn:
+            with timed("sql_execute"):
+                conn.execute(
+                    "INSERT INTO cellar (user_id, wine_id) VALUES (?, ?)",
+                    (params.user_id, params.wine_id),
+                )
+            with timed("sql_commit"):
                 conn.commit()
-                return ret
+
+    def remove_from_cellar(self, params: CellarRequest):
+        with self._shard(params.user_id).connection(write=True) as conn:
+            with timed("sql_execute"):
+                conn.execute(
+                    "DELETE FROM cellar WHERE user_id = ? AND wine_id = ?",
+                    (params.user_id, params.wine_id),
+                )
+            with timed("sql_commit"):
+                conn.commit()
+
+    def get_cellar(self, params: GetCellarRequest) -> List[int]:
+        with self._shard(params.user_id).connection() as conn:
+            with timed("sql_execute"):
+                rows = conn.execute(
+                    "SELECT wine_id FROM cellar WHERE user_id = ? ORDER BY id",
+                    (params.user_id,),
+                ).fetchall()
+        return [wine_id for (wine_id,) in rows]
+
+    def _decode_change_cursor(self, cursor: str | None) -> List[int]:
+        if not cursor:
+            return [0] * len(self.shards)
+        position = decode_cursor(cursor)
+        if "seq" not in position:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if position.get("layout") != self.layout:
+            # the log was replaced, by a restore or a rebalance, or the cursor
+            # is from before logs had ids
+            raise HTTPException(
+                status_code=410, detail="Cursor is from a change log that's gone"
+            )
+        try:
+            seqs = [int(seq) for seq in position["seq"]]
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if len(seqs) != len(self.shards):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return seqs
+
+    def get_cellar_changes(self, params: CellarChangesRequest) -> CellarChanges:
+        # each shard keeps its own log, so the cursor holds a position in
+        # each. every user's changes are on one shard, so they stay in order
+        seqs = self._decode_change_cursor(params.cursor)
+        budget = max(1, min(params.limit, MAX_CELLAR_CHANGES))
+        changes = []
+        for i, shard in enumerate(self.shards):
+            with shard.connection() as conn:
+                with timed("sql_execute"):
+                    (last_seq,) = conn.execute(
+                        "SELECT COALESCE(MAX(seq), 0) FROM cellar_log"
+                    ).fetchone()
+                    rows = conn.execute(
+                        """
+                        SELECT seq, user_id, wine_id, added FROM cellar_log
+                        WHERE seq > ? ORDER BY seq LIMIT ?
+                        """,
+                        (seqs[i], budget),
+                    ).fetchall()
+            if seqs[i] > last_seq:
+                # the log was rolled back behind the cursor without its id
+                # changing, so it can't be resumed
+                raise HTTPException(
+                    status_code=410, detail="Cursor is from a change log that's gone"
+                )
+            if rows:
+                seqs[i] = rows[-1][0]
+            budget -= len(rows)
+            changes.extend(
+                CellarChange(user_id=user_id, wine_id=wine_id, added=bool(added))
+                for _, user_id, wine_id, added in rows
+            )
+        return CellarChanges(
+            changes=changes, cursor=encode_cursor({"layout": self.layout, "seq": seqs})
+        )
+
+    def _execute(self, shard: Shard, params: SQLRequest, read_only: bool) -> List:
+        with shard.connection(write=not read_only) as conn:
+            if read_only:
+                conn.execute("PRAGMA query_only = ON")
+            try:
+                with closing(conn.cursor()) as cursor:
+                    with timed("sql_execute"):
+                        cursor.execute(params.query, params.params or ())
+                        ret = cursor.fetchall()
+                    with timed("sql_commit"):
+                        conn.commit()
+                    return ret
+            except sqlite3.OperationalError as e:
+                if read_only and e.sqlite_errorname == "SQLITE_READONLY":
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Writes need a user_id to pick the shard to write to",
+                    )
+                raise
+            finally:
+                if read_only:
+                    conn.execute("PRAGMA query_only = OFF")
+
+    def do_sql(self, params: SQLRequest) -> List[Tuple]:
+        if params.user_id is not None:
+            # whatever the query does runs on user_id's shard. nothing checks
+            # which users' rows it actually writes, that's up to the caller
+            return self._execute(self._shard(params.user_id), params, False)
+        if len(self.shards) == 1:
+            return self._execute(self.shards[0], params, False)
+        # with no user to route by, reads go to every shard and their rows are
+        # concatenated. ordering, limits and aggregates only apply per shard
+        rows = []
+        for shard in self.shards:
+            rows.extend(self._execute(shard, params, True))
+        return rows
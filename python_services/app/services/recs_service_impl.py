@@ -1,19 +1,42 @@
+import logging
 import os
 import shutil
+import threading
 import time
 import chromadb
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
 from collections import deque
-from typing import Deque, Dict, List
+from functools import lru_cache
+from typing import Deque, Dict, List, Tuple
 
 from fastapi import HTTPException
 
 from ..common.config import ServiceSettings
-from ..common.api import GetWineRequest, RecsRequest, Wine
+from ..common.api import (
+    CellarRecsRequest,
+    GetWineRequest,
+    RecsRequest,
+    Wine,
+    normalize_query,
+)
+from ..common.deadline import check_deadline
+from ..common.metrics import timed
+from ..common.singleflight import SingleFlight
+from .cooccurrence import CooccurrenceModel
+from .hot_queries import HotQueries
+
+logger = logging.getLogger(__name__)
 
 
 class RecsServiceImpl:
     def __init__(
-        self, settings: ServiceSettings, reset: bool = False, catalog_service=None
+        self,
+        settings: ServiceSettings,
+        reset: bool = False,
+        catalog_service=None,
+        embedding_function=None,
+        hot_queries: HotQueries | None = None,
+        cooccurrence: CooccurrenceModel | None = None,
     ):
         self.recs_demo_failure = settings.recs_demo_failure
         self.catalog_service = catalog_service
@@ -21,9 +44,25 @@ class RecsServiceImpl:
         if reset and os.path.exists(path):
             shutil.rmtree(path)
         self.chroma_client = chromadb.PersistentClient(path)
+        # embed queries ourselves rather than letting chroma do it, so the
+        # embedding and the nearest neighbor search can be timed separately.
+        # the data must be loaded with the embedding function it was built with
+        self.embedding_function = embedding_function or DefaultEmbeddingFunction()
         self.collection = self.chroma_client.get_or_create_collection(
-            name="my_collection"
+            name="my_collection", embedding_function=self.embedding_function
+        )
+        self.queries = SingleFlight[List[int]]("recs_query")
+        # the data never changes under a generation, so neither do results
+        self._embed = lru_cache(settings.recs_embedding_cache_size)(self._embed)
+        self._cached_query = lru_cache(settings.recs_result_cache_size)(
+            self._cached_query
         )
+        self.hot_queries = hot_queries
+        self.cooccurrence = cooccurrence
+        # set once the caches are warm, see prewarm
+        self.ready = threading.Event()
+        self.ready.set()
+        self._closed = threading.Event()
         self._init_failure_simulation()
 
     def open_index(self):
@@ -72,22 +111,84 @@ class RecsServiceImpl:
                 400, "Service temporarily unavailable due to high query volume"
             )
 
+    def _embed(self, query: str):
+        with timed("recs_embed"):
+            return self.embedding_function([query])
+
+    def _cached_query(self, query: str, limit: int) -> Tuple[int, ...]:
+        embeddings = self._embed(query)
+        with timed("recs_ann"):
+            results = self.collection.query(
+                query_embeddings=embeddings, n_results=limit
+            )
+        return tuple(int(id) for id in results["ids"][0])
+
+    def _query(self, query: str, limit: int) -> List[int]:
+        # identical queries arriving together share one embedding and search
+        return list(
+            self.queries.do((query, limit), lambda: self._cached_query(query, limit))
+        )
+
+    def prewarm(self, count: int):
+        """
+        Warm the caches with the count most frequent queries in the
+        background. ready is cleared until it's done.
+        """
+        if self.hot_queries is None or count <= 0:
+            return
+        keys = [key for key, _ in self.hot_queries.most_common(count)]
+        if not keys:
+            return
+        self.ready.clear()
+
+        def run():
+            start = time.monotonic()
+            try:
+                for key in keys:
+                    if self._closed.is_set():
+                        return
+                    limit, query = key.split(" ", 1)
+                    self._query(query, int(limit))
+                logger.info(
+                    "prewarmed %d queries in %.1fs", len(keys), time.monotonic() - start
+                )
+            except Exception:
+                # a cold cache is slower, not broken
+                logger.exception("failed to prewarm recs caches")
+            finally:
+                self.ready.set()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def close(self):
+        """Stop any warming up, once this generation is no longer served"""
+        self._closed.set()
+
     def get_recommendations_unfiltered(self, params: RecsRequest) -> List[int]:
-        q = {}
-        q["n_results"] = params.limit
-        q["query_texts"] = [params.query]
-        results = self.collection.query(**q)
-        all_ids = [int(id) for id in results["ids"][0]]
+        all_ids = self._query(normalize_query(params.query), params.limit)
         if self.recs_demo_failure:
             self._check_failure_condition(params.query)
         return all_ids
 
     def get_recommendations(self, params: RecsRequest) -> List[int]:
+        if self.hot_queries is not None:
+            # parsed back into a query by prewarm
+            self.hot_queries.record(f"{params.limit} {normalize_query(params.query)}")
         all_ids = self.get_recommendations_unfiltered(params)
         # in a real RAG, we would call into catalog and get more
         # info and iterate. In this case we just want to demonstrate
         # we can call the catalog service and get junction routing
         if len(all_ids) > 0:
-            self.catalog_service.get_wine(GetWineRequest(ids=all_ids))
+            check_deadline()
+            with timed("recs_catalog_call"):
+                self.catalog_service.get_wine(GetWineRequest(ids=all_ids))
 
         return all_ids[: params.limit]
+
+    def get_cellar_recommendations(self, params: CellarRecsRequest) -> List[int]:
+        if self.cooccurrence is None:
+            raise HTTPException(404, "Cellar recommendations are disabled")
+        with timed("recs_cellar"):
+            return self.cooccurrence.recommend(
+                params.user_id, params.wine_id, params.limit
+            )
@@ -1,12 +1,40 @@
 import os
 import random
 import shutil
-import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+from fastapi import HTTPException
+from whoosh.collectors import TopCollector
 from whoosh.filedb.filestore import FileStorage
 from whoosh.fields import Schema, TEXT, ID, NUMERIC
 from whoosh.qparser import MultifieldParser
+from whoosh.query import Query
+from whoosh.searching import Hit, Searcher
+from ..common import deadline
 from ..common.config import ServiceSettings
-from ..common.api import SearchRequest, PaginatedList, Wine
+from ..common.cursor import decode_cursor, encode_cursor
+from ..common.metrics import timed
+from ..common.singleflight import SingleFlight
+from ..common.api import (
+    AutocompleteRequest,
+    SearchRequest,
+    PaginatedList,
+    Wine,
+    normalize_query,
+)
+from .autocomplete import AutocompleteIndex
+from .spelling import SpellingCorrector
+
+SEARCH_FIELDS = [
+    "title",
+    "description",
+    "variety",
+    "winery",
+    "country",
+    "province",
+    "region_1",
+    "region_2",
+]
 
 
 class SearchServiceImpl:
@@ -31,13 +59,46 @@ class SearchServiceImpl:
         if not os.path.exists(path):
             os.mkdir(path)
         self.storage = FileStorage(path, supports_mmap=False)
+        self.autocomplete_file_name = os.path.join(path, "autocomplete.json")
         if reset:
             self.index = self.storage.create_index(indexname="index", schema=schema)
+            self.autocomplete_index = AutocompleteIndex.empty()
         else:
             self.index = self.storage.open_index(indexname="index")
+            if os.path.exists(self.autocomplete_file_name):
+                self.autocomplete_index = AutocompleteIndex.load(
+                    self.autocomplete_file_name
+                )
+            else:
+                self.autocomplete_index = AutocompleteIndex.empty()
+        self.searches = SingleFlight[PaginatedList[int]]("search")
+        self.spelling_corrector = None
+        if settings.search_spelling_correction and not reset:
+            self.spelling_corrector = SpellingCorrector(self._vocabulary())
+
+    def _vocabulary(self) -> Dict[str, int]:
+        vocabulary = defaultdict(int)
+        with self.index.reader() as reader:
+            for fieldname in SEARCH_FIELDS:
+                field = self.index.schema[fieldname]
+                for term, info in reader.iter_field(fieldname):
+                    vocabulary[field.from_bytes(term)] += info.doc_frequency()
+        return vocabulary
+
+    def _correct_spelling(self, query: Query) -> Query:
+        # the multifield parser repeats every term once per field, so only
+        # look each one up once
+        corrections = {}
+        for fieldname, text in set(query.iter_all_terms()):
+            if text not in corrections:
+                corrections[text] = self.spelling_corrector.correct(text)
+            if corrections[text] is not None:
+                query = query.replace(fieldname, text, corrections[text])
+        return query
 
     def open_index(self):
         self.writer = self.index.writer()
+        self.autocomplete_counts = Counter()
 
     def add_wine(self, wine: Wine):
         self.writer.add_document(
@@ -53,40 +114,108 @@ class SearchServiceImpl:
             points=float(wine.points) if wine.points else 0.0,
             price=float(wine.price) if wine.price else 0.0,
         )
+        for name in (wine.title, wine.winery, wine.variety, wine.region_1):
+            if name:
+                self.autocomplete_counts[name] += 1
 
     def build_index(self):
         self.writer.commit()
         del self.writer
+        self.autocomplete_index = AutocompleteIndex.build(self.autocomplete_counts)
+        self.autocomplete_index.save(self.autocomplete_file_name)
+        del self.autocomplete_counts
+
+    def autocomplete(self, params: AutocompleteRequest) -> List[str]:
+        return self.autocomplete_index.complete(params.prefix, params.limit)
 
     def search(self, params: SearchRequest) -> PaginatedList[int]:
+        deadline.check_deadline()
         if self.search_demo_latency:
             if random.random() < 0.5:
-                time.sleep(10)
+                deadline.sleep(10)
 
+        # identical searches arriving together share one run of the search
+        key = (
+            normalize_query(params.query),
+            params.page,
+            params.page_size,
+            params.cursor,
+        )
+        try:
+            return self.searches.do(key, lambda: self._search(params))
+        except deadline.DeadlineExceeded:
+            # the search that was shared may have been given up on by a
+            # caller with an earlier deadline than this one
+            deadline.check_deadline()
+            return self._search(params)
+
+    def _search(self, params: SearchRequest) -> PaginatedList[int]:
         with self.index.searcher() as searcher:
-            fields = [
-                "title",
-                "description",
-                "variety",
-                "winery",
-                "country",
-                "province",
-                "region_1",
-                "region_2",
-            ]
-            parser = MultifieldParser(fields, self.index.schema)
-            query = parser.parse(params.query)
-            start = (params.page - 1) * params.page_size
-            results = searcher.search(query, limit=None)
+            with timed("search_parse"):
+                parser = MultifieldParser(SEARCH_FIELDS, self.index.schema)
+                query = parser.parse(params.query)
+                if self.spelling_corrector:
+                    query = self._correct_spelling(query)
+            deadline.check_deadline()
+            with timed("search_score"):
+                hits, total = self._collect(searcher, query, params)
+
+            next_cursor = None
+            if len(hits) == params.page_size:
+                next_cursor = encode_cursor(
+                    {"score": hits[-1].score, "doc": hits[-1].docnum}
+                )
             return PaginatedList[int].model_validate(
                 {
-                    "items": [
-                        int(hit["id"])
-                        for hit in results[start : start + params.page_size]
-                    ],
-                    "total": len(results),
+                    "items": [int(hit["id"]) for hit in hits],
+                    "total": total,
                     "page": params.page,
                     "page_size": params.page_size,
-                    "total_pages": (len(results) + params.page_size - 1),
+                    "total_pages": (total + params.page_size - 1) // params.page_size,
+                    "next_cursor": next_cursor,
                 }
             )
+
+    def _collect(
+        self, searcher: Searcher, query: Query, params: SearchRequest
+    ) -> Tuple[List[Hit], int]:
+        if params.cursor:
+            position = decode_cursor(params.cursor)
+            try:
+                collector = AfterCursorCollector(
+                    float(position["score"]), int(position["doc"]), params.page_size
+                )
+            except (KeyError, TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            searcher.search_with_collector(query, collector)
+            results = collector.results()
+            return list(results), len(results)
+
+        # only collect as many results as needed to reach this page, rather
+        # than scoring and sorting every match
+        start = (params.page - 1) * params.page_size
+        results = searcher.search(query, limit=start + params.page_size)
+        return list(results[start : start + params.page_size]), len(results)
+
+
+class AfterCursorCollector(TopCollector):
+    """
+    Collects the top results that rank strictly after a previously returned
+    hit. Results are ordered by descending score and then ascending docnum,
+    so resuming only needs the last (score, docnum) and a heap the size of
+    one page instead of re-collecting every earlier page.
+    """
+
+    def __init__(self, score: float, docnum: int, limit: int):
+        super().__init__(limit=limit)
+        self.after_score = score
+        self.after_docnum = docnum
+
+    def _collect(self, global_docnum, score):
+        if score > self.after_score or (
+            score == self.after_score and global_docnum <= self.after_docnum
+        ):
+            # already returned in an earlier page, but still a match
+            self.total += 1
+            return 0
+        return super()._collect(global_docnum, score)
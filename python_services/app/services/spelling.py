@@ -0,0 +1,101 @@
+from collections import defaultdict
+from itertools import combinations
+from typing import Dict, List, Set
+
+
+class SpellingCorrector:
+    """
+    Symmetric-delete spelling correction (as in SymSpell) over an indexed
+    vocabulary.
+
+    Every vocabulary term is registered under all the strings reachable by
+    deleting up to max_distance characters from its first prefix_length
+    characters. A misspelled term then only needs to generate its own deletes
+    and check the few terms that share one, so a lookup costs a bounded number
+    of dict hits no matter how large the vocabulary is.
+    """
+
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        max_distance: int = 2,
+        prefix_length: int = 7,
+    ):
+        self.vocabulary = vocabulary
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.deletes: Dict[str, List[str]] = defaultdict(list)
+        for term in vocabulary:
+            if self._is_correctable(term):
+                for delete in self._deletes(term, self._max_distance(term)):
+                    self.deletes[delete].append(term)
+
+    def correct(self, term: str) -> str | None:
+        """Returns the best replacement for an unknown term, or None."""
+        if term in self.vocabulary or not self._is_correctable(term):
+            return None
+
+        max_distance = self._max_distance(term)
+        best = None
+        seen: Set[str] = set()
+        for delete in self._deletes(term, max_distance):
+            for candidate in self.deletes.get(delete, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = _bounded_distance(term, candidate, max_distance)
+                if distance > max_distance:
+                    continue
+                rank = (distance, -self.vocabulary[candidate], candidate)
+                if best is None or rank < best:
+                    best = rank
+        return best[2] if best else None
+
+    def _max_distance(self, term: str) -> int:
+        # a two character edit turns most short words into something else
+        return 1 if len(term) <= 4 else self.max_distance
+
+    def _is_correctable(self, term: str) -> bool:
+        return len(term) > 2 and not any(c.isdigit() for c in term)
+
+    def _deletes(self, term: str, max_distance: int) -> Set[str]:
+        prefix = term[: self.prefix_length]
+        deletes = {prefix}
+        for n in range(1, min(max_distance, len(prefix) - 1) + 1):
+            for positions in combinations(range(len(prefix)), n):
+                deletes.add(
+                    "".join(c for i, c in enumerate(prefix) if i not in positions)
+                )
+        return deletes
+
+
+def _bounded_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Optimal string alignment distance between a and b, giving up with
+    max_distance + 1 as soon as the distance is known to exceed max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + cost,
+            )
+            if (
+                previous2 is not None
+                and i > 1
+                and j > 1
+                and a[i - 1] == b[j - 2]
+                and a[i - 2] == b[j - 1]
+            ):
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
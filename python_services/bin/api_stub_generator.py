@@ -43,6 +43,15 @@ def generate_method(service_name, method_name: str, method_def: dict) -> str:
     request_var = "None" if method_def["params"] is None else "request.model_dump()"
     api_call = f"self.client.{method_def['method'].lower()}({service_name}['{method_name}']['path'], {request_var}, options)"
 
+    if method_def.get("stream"):
+        if method_def["method"] != "GET":
+            raise ValueError(f"{service_name}.{method_name}: only GETs can stream")
+        stream_call = f"self.client.get_stream({service_name}['{method_name}']['path'], {request_var}, options)"
+        return f"""
+    def {method_name}(self, {params}) -> Iterator[{return_type}]:
+       for item in {stream_call}:
+           yield {return_type}.model_validate(item)"""
+
     if method_def["response"] is None:
         body = api_call
     elif get_origin(method_def["response"]) == list:
@@ -55,6 +64,42 @@ def generate_method(service_name, method_name: str, method_def: dict) -> str:
        return {body}"""
 
 
+def generate_caching_method(service_name, method_name: str, method_def: dict) -> str:
+    if method_def["method"] != "GET" or get_origin(method_def["response"]) is not list:
+        raise ValueError(
+            f"{service_name}.{method_name}: only GETs returning lists can be cached"
+        )
+    key_field = method_def["cache_by"]
+    params_type = method_def["params"].__name__
+    return_type = method_def["response"].__name__
+    get_call = f"self.client.get_with_headers({service_name}['{method_name}']['path'], request.model_copy(update={{'{key_field}': keys}}).model_dump(), options)"
+    return f"""
+    def {method_name}(self, request: {params_type}, options: HttpClientOptions = HttpClientOptions()) -> {return_type}:
+       def fetch(keys):
+           response, headers = {get_call}
+           return TypeAdapter({return_type}).validate_python(response), headers
+       return self.cache.get_many(request.{key_field}, fetch)"""
+
+
+def generate_caching_service(
+    service_name: str, service_def: Dict[str, ServiceMethodDef]
+) -> str | None:
+    """A subclass of the remote service caching the methods with cache_by set"""
+    cached = {name: defn for name, defn in service_def.items() if defn.get("cache_by")}
+    if not cached:
+        return None
+    class_name = snake_to_pascal(service_name)
+    ret = f"""class Caching{class_name}({class_name}):
+    def __init__(self, client: HttpClient, cache: VersionedCache):
+        super().__init__(client)
+        self.cache = cache
+"""
+    for name, defn in cached.items():
+        ret += generate_caching_method(service_name, name, defn)
+        ret += "\n"
+    return ret
+
+
 def generate_remote_service(
     service_name: str, service_def: Dict[str, ServiceMethodDef]
 ) -> str:
@@ -76,8 +121,10 @@ services = {
     "PERSIST_SERVICE": PERSIST_SERVICE,
 }
 print("""
+from typing import Iterator
 from pydantic import TypeAdapter
 from .api import *
+from .cache import VersionedCache
 from .http_client import HttpClient, HttpClientOptions
 
 #
@@ -88,3 +135,6 @@ from .http_client import HttpClient, HttpClientOptions
 for name, definition in services.items():
     print(generate_remote_service(name, definition))
     print()
+    if caching_service := generate_caching_service(name, definition):
+        print(caching_service)
+        print()
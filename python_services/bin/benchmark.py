@@ -0,0 +1,600 @@
+"""
+Offline benchmarks for the service implementations.
+
+Builds synthetic catalogs of each requested size with build_data.py, then
+measures how long each service takes to load the data and how much memory it
+uses, and the latency and single threaded throughput of each of its methods.
+Persist's writes are also measured for a range of shard counts, from many
+threads of one process and from one process per shard group. The threads
+share the GIL, which caps them at about what one thread manages however many
+shards there are, so it's the processes that show how far the shards scale,
+given as many CPUs as processes.
+Recs embeds with a hashing embedding function instead of the real model, so
+nothing is downloaded and its numbers measure the vector store rather than
+the model.
+
+    python python_services/bin/benchmark.py --sizes 1000,100000 --out bench.json
+    python python_services/bin/benchmark.py --baseline bench.json
+"""
+
+import os
+import sys
+
+sys.path.append(
+    os.path.abspath(
+        os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir)
+    )
+)
+import argparse
+import gc
+import hashlib
+import json
+import multiprocessing
+import platform
+import random
+import re
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterator, List
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from build_data import build_data
+from python_services.app.common.api import (
+    AutocompleteRequest,
+    BrowseWinesRequest,
+    CellarRequest,
+    ExportWinesRequest,
+    GetCellarRequest,
+    RecsRequest,
+    SearchRequest,
+    SQLRequest,
+)
+from python_services.app.common.config import ServiceSettings
+from python_services.app.services.catalog_service_impl import CatalogServiceImpl
+from python_services.app.services.persist_service_impl import (
+    PersistServiceImpl,
+    shard_for,
+)
+from python_services.app.services.recs_service_impl import RecsServiceImpl
+from python_services.app.services.search_service_impl import SearchServiceImpl
+
+COUNTRIES = ["US", "France", "Italy", "Spain", "Portugal", "Chile", "Argentina"]
+VARIETIES = [
+    "Pinot Noir",
+    "Chardonnay",
+    "Cabernet Sauvignon",
+    "Red Blend",
+    "Riesling",
+    "Sauvignon Blanc",
+    "Syrah",
+    "Rosé",
+    "Merlot",
+    "Malbec",
+]
+REGIONS = ["Napa Valley", "Bordeaux", "Tuscany", "Rioja", "Douro", "Mendoza"]
+WORDS = (
+    "aromas palate fruit cherry black red finish tannins acidity oak berry "
+    "plum spice vanilla notes dry crisp citrus apple pear peach lemon ripe "
+    "soft juicy structure chocolate pepper herbal earthy mineral floral "
+    "toast smoke leather tobacco licorice currant raspberry blackberry "
+    "honey apricot melon tropical lime grapefruit firm round rich bright"
+).split()
+# metrics where a bigger number is a regression, and where a smaller one is
+LOWER_IS_BETTER = {"seconds", "memory_bytes", "p50_ms", "p99_ms", "mean_ms"}
+HIGHER_IS_BETTER = {"ops_per_second"}
+# persist's concurrent writes are measured with each of these numbers of shards
+PERSIST_SHARD_COUNTS = [1, 2, 4, 8]
+PERSIST_WRITER_THREADS = 16
+# writer process i only adds to the cellars of users on shard i modulo the shards
+PERSIST_WRITER_PROCESSES = max(PERSIST_SHARD_COUNTS)
+PERSIST_USERS = 10000
+
+
+class HashEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Hashes words into a fixed size vector, so no model is needed"""
+
+    def __init__(self, dimensions: int = 128):
+        self.dimensions = dimensions
+
+    def __call__(self, input: Documents) -> Embeddings:
+        embeddings = []
+        for document in input:
+            vector = np.zeros(self.dimensions, dtype=np.float32)
+            for word in re.findall(r"\w+", document.lower()):
+                digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vector[value % self.dimensions] += 1 if value >> 63 else -1
+            norm = np.linalg.norm(vector)
+            embeddings.append(vector / norm if norm else vector)
+        return embeddings
+
+    @staticmethod
+    def name() -> str:
+        return "wineinfo_benchmark_hash"
+
+    def get_config(self) -> Dict:
+        return {"dimensions": self.dimensions}
+
+    @staticmethod
+    def build_from_config(config: Dict) -> "HashEmbeddingFunction":
+        return HashEmbeddingFunction(config["dimensions"])
+
+
+def synthetic_rows(n: int, seed: int) -> Iterator[Dict]:
+    """Rows in the format of the source csv, with skewed word frequencies"""
+    rng = random.Random(seed)
+    # a few words are common and most are rare, as in real descriptions
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+    for i in range(n):
+        country = rng.choice(COUNTRIES)
+        variety = rng.choice(VARIETIES)
+        winery = f"Winery {rng.randrange(max(n // 20, 1))}"
+        region = rng.choice(REGIONS)
+        description = " ".join(rng.choices(WORDS, weights, k=rng.randint(20, 50)))
+        yield {
+            "id": str(i),
+            "title": f"{winery} {rng.randint(1990, 2020)} {variety} ({region})",
+            "country": country,
+            "description": description.capitalize() + ".",
+            "designation": rng.choice(["", "Reserve", "Estate", "Old Vines"]),
+            "points": str(rng.randint(80, 100)),
+            "price": str(rng.randint(8, 300)) if rng.random() < 0.9 else "",
+            "province": region,
+            "region_1": region,
+            "region_2": "",
+            "taster_name": "",
+            "taster_twitter_handle": "",
+            "variety": variety,
+            "winery": winery,
+        }
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # peak rather than current usage, but good enough off Linux
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def measure_load(load: Callable[[], object]):
+    gc.collect()
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    impl = load()
+    seconds = time.perf_counter() - start
+    gc.collect()
+    return impl, {"seconds": seconds, "memory_bytes": _rss_bytes() - rss_before}
+
+
+def measure_calls(call: Callable[[random.Random], object], iterations: int) -> Dict:
+    rng = random.Random(0)
+    # a few untimed calls first, so caches and lazy imports are warm
+    for _ in range(min(iterations, 10)):
+        call(rng)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        call(rng)
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    return _call_stats(latencies, elapsed)
+
+
+def measure_concurrent_calls(
+    call: Callable[[random.Random], object], iterations: int, threads: int
+) -> Dict:
+    """Like measure_calls, with threads threads each making iterations calls"""
+    rng = random.Random(0)
+    for _ in range(min(iterations, 10)):
+        call(rng)
+    latencies: List[float] = []
+    lock = threading.Lock()
+    ready = threading.Barrier(threads + 1)
+
+    def run(seed: int):
+        rng = random.Random(seed)
+        thread_latencies = []
+        ready.wait()
+        for _ in range(iterations):
+            call_start = time.perf_counter()
+            call(rng)
+            thread_latencies.append(time.perf_counter() - call_start)
+        with lock:
+            latencies.extend(thread_latencies)
+
+    workers = [threading.Thread(target=run, args=(seed,)) for seed in range(threads)]
+    for worker in workers:
+        worker.start()
+    ready.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return _call_stats(latencies, elapsed)
+
+
+def _persist_writer(
+    settings: ServiceSettings,
+    process: int,
+    size: int,
+    iterations: int,
+    ready,
+    latencies,
+):
+    shards = settings.persist_shards
+    impl = PersistServiceImpl(settings)
+    rng = random.Random(process)
+    user_ids = [
+        user_id
+        for user_id in range(PERSIST_USERS)
+        if shard_for(user_id, shards) == process % shards
+    ]
+
+    def call():
+        impl.add_to_cellar(
+            CellarRequest(user_id=rng.choice(user_ids), wine_id=rng.randrange(size))
+        )
+
+    for _ in range(min(iterations, 10)):
+        call()
+    process_latencies = []
+    ready.wait()
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        call()
+        process_latencies.append(time.perf_counter() - call_start)
+    latencies.put(process_latencies)
+
+
+def measure_persist_writer_processes(
+    settings: ServiceSettings, size: int, iterations: int, processes: int
+) -> Dict:
+    """add_to_cellar from processes processes each making iterations calls"""
+    ready = multiprocessing.Barrier(processes + 1)
+    queue = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=_persist_writer,
+            args=(settings, process, size, iterations, ready, queue),
+        )
+        for process in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    ready.wait()
+    start = time.perf_counter()
+    latencies: List[float] = []
+    for _ in workers:
+        latencies.extend(queue.get())
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+    return _call_stats(latencies, elapsed)
+
+
+def _call_stats(latencies: List[float], elapsed: float) -> Dict:
+    latencies.sort()
+    return {
+        "calls": len(latencies),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "ops_per_second": len(latencies) / elapsed,
+    }
+
+
+def _query(rng: random.Random) -> str:
+    return " ".join(rng.sample(WORDS, rng.randint(1, 3)))
+
+
+def bench_catalog(settings: ServiceSettings, size: int, iterations: int) -> Dict:
+    impl, result = measure_load(lambda: CatalogServiceImpl(settings))
+    result["methods"] = {
+        "get_wine": measure_calls(
+            lambda rng: impl.get_wine([rng.randrange(size) for _ in range(20)]),
+            iterations,
+        ),
+        "get_all_wines_paginated": measure_calls(
+            lambda rng: impl.get_all_wines_paginated(
+                rng.randint(1, max(size // 20, 1)), 20
+            ),
+            iterations,
+        ),
+        "browse_wines": measure_calls(
+            lambda rng: impl.browse_wines(
+                BrowseWinesRequest(
+                    country=rng.choice(COUNTRIES),
+                    min_points=rng.randint(80, 95),
+                    sort_by="price",
+                    descending=True,
+                )
+            ),
+            iterations,
+        ),
+        "export_wines": measure_calls(
+            lambda rng: sum(
+                1
+                for _ in impl.export_wines(
+                    ExportWinesRequest(country=rng.choice(COUNTRIES), end_id=1000)
+                )
+            ),
+            iterations,
+        ),
+    }
+    return result
+
+
+def bench_search(settings: ServiceSettings, size: int, iterations: int) -> Dict:
+    impl, result = measure_load(lambda: SearchServiceImpl(settings))
+    result["methods"] = {
+        "search": measure_calls(
+            lambda rng: impl.search(SearchRequest(query=_query(rng))), iterations
+        ),
+        "autocomplete": measure_calls(
+            lambda rng: impl.autocomplete(
+                AutocompleteRequest(prefix=rng.choice(WORDS)[: rng.randint(1, 4)])
+            ),
+            iterations,
+        ),
+    }
+    return result
+
+
+def bench_recs(settings: ServiceSettings, size: int, iterations: int) -> Dict:
+    impl, result = measure_load(
+        lambda: RecsServiceImpl(settings, embedding_function=HashEmbeddingFunction())
+    )
+    # get_recommendations only adds a call to catalog on top of this, which
+    # is measured by the catalog benchmarks
+    result["methods"] = {
+        "get_recommendations_unfiltered": measure_calls(
+            lambda rng: impl.get_recommendations_unfiltered(
+                RecsRequest(query=_query(rng))
+            ),
+            iterations,
+        ),
+    }
+    return result
+
+
+def bench_persist(settings: ServiceSettings, size: int, iterations: int) -> Dict:
+    impl, result = measure_load(lambda: PersistServiceImpl(settings))
+    result["methods"] = {
+        "do_sql_insert": measure_calls(
+            lambda rng: _do_sql_insert(impl, rng.randrange(100), rng.randrange(size)),
+            iterations,
+        ),
+        "do_sql_select": measure_calls(
+            lambda rng: _do_sql_select(impl, rng.randrange(100)),
+            iterations,
+        ),
+        "add_to_cellar": measure_calls(
+            lambda rng: impl.add_to_cellar(
+                CellarRequest(user_id=rng.randrange(100), wine_id=rng.randrange(size))
+            ),
+            iterations,
+        ),
+        "get_cellar": measure_calls(
+            lambda rng: impl.get_cellar(GetCellarRequest(user_id=rng.randrange(100))),
+            iterations,
+        ),
+    }
+    for shards in PERSIST_SHARD_COUNTS:
+        # each shard count writes to its own empty databases
+        data_path = os.path.join(settings.data_path, f"persist-{shards}-shards")
+        os.makedirs(data_path)
+        sharded_settings = settings.model_copy(
+            update={"data_path": data_path, "persist_shards": shards}
+        )
+        sharded = PersistServiceImpl(sharded_settings)
+        result["methods"][
+            f"add_to_cellar_{PERSIST_WRITER_THREADS}_threads_{shards}_shards"
+        ] = measure_concurrent_calls(
+            lambda rng: sharded.add_to_cellar(
+                CellarRequest(
+                    user_id=rng.randrange(PERSIST_USERS), wine_id=rng.randrange(size)
+                )
+            ),
+            iterations,
+            PERSIST_WRITER_THREADS,
+        )
+        result["methods"][
+            f"add_to_cellar_{PERSIST_WRITER_PROCESSES}_processes_{shards}_shards"
+        ] = measure_persist_writer_processes(
+            sharded_settings, size, iterations, PERSIST_WRITER_PROCESSES
+        )
+    return result
+
+
+def _do_sql_insert(impl: PersistServiceImpl, user_id: int, wine_id: int):
+    impl.do_sql(
+        SQLRequest(
+            query="INSERT INTO cellar (wine_id, user_id) VALUES (?, ?)",
+            params=[wine_id, user_id],
+            user_id=user_id,
+        )
+    )
+
+
+def _do_sql_select(impl: PersistServiceImpl, user_id: int):
+    impl.do_sql(
+        SQLRequest(
+            query="SELECT wine_id FROM cellar WHERE user_id = ?",
+            params=[user_id],
+            user_id=user_id,
+        )
+    )
+
+
+BENCHMARKS = {
+    "catalog": bench_catalog,
+    "search": bench_search,
+    "recs": bench_recs,
+    "persist": bench_persist,
+}
+
+
+def run(sizes: List[int], services: List[str], iterations: int, seed: int) -> Dict:
+    results = {}
+    for size in sizes:
+        data_path = tempfile.mkdtemp(prefix=f"wineinfo-bench-{size}-")
+        try:
+            settings = ServiceSettings(data_path=data_path, data_reload_interval=0)
+            print(f"building {size} wines in {data_path}", file=sys.stderr)
+            _, build = measure_load(
+                lambda: build_data(
+                    settings,
+                    synthetic_rows(size, seed),
+                    embedding_function=HashEmbeddingFunction(),
+                )
+            )
+            results[str(size)] = {"build_data": build}
+            for service in services:
+                print(f"benchmarking {service} with {size} wines", file=sys.stderr)
+                results[str(size)][service] = BENCHMARKS[service](
+                    settings, size, iterations
+                )
+                gc.collect()
+        finally:
+            shutil.rmtree(data_path, ignore_errors=True)
+    return results
+
+
+def _flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(
+    results: Dict, baseline: Dict, threshold: float, memory_threshold: float
+) -> List[str]:
+    """Describe every metric that got worse than the baseline by the threshold"""
+    current = _flatten(results)
+    regressions = []
+    for name, old in _flatten(baseline).items():
+        metric = name.rsplit(".", 1)[-1]
+        if name not in current or old <= 0:
+            continue
+        change = (current[name] - old) / old
+        limit = memory_threshold if metric == "memory_bytes" else threshold
+        if (metric in LOWER_IS_BETTER and change > limit) or (
+            metric in HIGHER_IS_BETTER and -change > limit
+        ):
+            regressions.append(
+                f"{name}: {old:.4g} -> {current[name]:.4g} ({change:+.0%})"
+            )
+    return regressions
+
+
+def print_results(results: Dict):
+    for size, services in results.items():
+        build = services["build_data"]
+        print(f"{size} wines: build_data {build['seconds']:.2f}s")
+        for service, result in services.items():
+            if service == "build_data":
+                continue
+            print(
+                f"  {service}: load {result['seconds']:.3f}s "
+                f"{result['memory_bytes'] / 1e6:.1f}MB"
+            )
+            methods = result["methods"]
+            for method, stats in methods.items():
+                line = (
+                    f"    {method:36} p50 {stats['p50_ms']:8.3f}ms "
+                    f"p99 {stats['p99_ms']:8.3f}ms "
+                    f"{stats['ops_per_second']:10.1f}/s"
+                )
+                # the throughput of a sharded run against the same run on one shard
+                one_shard = re.sub(r"_\d+_shards$", "_1_shards", method)
+                if one_shard != method and one_shard in methods:
+                    scaling = (
+                        stats["ops_per_second"] / methods[one_shard]["ops_per_second"]
+                    )
+                    line += f" {scaling:5.2f}x one shard"
+                print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the wineinfo services")
+    parser.add_argument(
+        "--sizes",
+        default="1000,10000",
+        help="Comma separated numbers of wines to benchmark with, up to 1000000",
+    )
+    parser.add_argument(
+        "--services",
+        default=",".join(BENCHMARKS),
+        help="Comma separated services to benchmark",
+    )
+    parser.add_argument(
+        "--iterations", default=200, type=int, help="Calls to time per method"
+    )
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--out", default=None, help="Write the results to this file")
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="Compare against results from an earlier run, and exit non-zero on "
+        "any regression",
+    )
+    parser.add_argument(
+        "--threshold",
+        default=0.2,
+        type=float,
+        help="How much worse than the baseline a time or rate may get",
+    )
+    parser.add_argument(
+        "--memory-threshold",
+        default=0.1,
+        type=float,
+        help="How much worse than the baseline memory use may get",
+    )
+    args = parser.parse_args()
+
+    services = args.services.split(",")
+    for service in services:
+        if service not in BENCHMARKS:
+            parser.error(f"unknown service {service}")
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": run(
+            [int(size) for size in args.sizes.split(",")],
+            services,
+            args.iterations,
+            args.seed,
+        ),
+    }
+    print_results(results["results"])
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(
+            results["results"],
+            baseline["results"],
+            args.threshold,
+            args.memory_threshold,
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("no regressions against the baseline")
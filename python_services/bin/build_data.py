@@ -7,12 +7,61 @@ sys.path.append(
 )
 from python_services.app.common.config import ServiceSettings
 from python_services.app.common.api import Wine
+from python_services.app.common.artifact import pack_artifact
+from python_services.app.common.reloader import (
+    publish_data_version,
+    versioned_settings,
+)
 from python_services.app.services.catalog_service_impl import CatalogServiceImpl
 from python_services.app.services.recs_service_impl import RecsServiceImpl
 from python_services.app.services.search_service_impl import SearchServiceImpl
 from python_services.app.services.persist_service_impl import PersistServiceImpl
 import csv
 import argparse
+from typing import Dict, Iterable
+
+
+def build_data(
+    settings: ServiceSettings,
+    rows: Iterable[Dict],
+    lines: int = 0,
+    embedding_function=None,
+):
+    """
+    Build the data for every service into settings.data_path from rows in the
+    format of the source csv. lines limits the number of rows used, 0 means
+    use them all.
+    """
+    os.makedirs(settings.data_path, exist_ok=True)
+    catalog_service = CatalogServiceImpl(settings, True)
+    recs_service = RecsServiceImpl(
+        settings, True, embedding_function=embedding_function
+    )
+    search_service = SearchServiceImpl(settings, True)
+    search_service.open_index()
+    recs_service.open_index()
+    with open(catalog_service.file_name, "w", encoding="utf-8") as catalog_file:
+        csv_writer = csv.DictWriter(catalog_file, Wine.model_fields)
+        csv_writer.writeheader()
+        n = 0
+        for row in rows:
+            row = {k: v if v is not None else "" for k, v in row.items()}
+            # clean up the
+            row["title"] = row["title"].removesuffix(" (" + row["region_1"] + ")")
+            row["title"] = row["title"].removesuffix(" (" + row["province"] + ")")
+            row["title"] = row["title"].strip()
+            wine = Wine.model_validate(row)
+            wine = catalog_service.add_wine(wine)
+            csv_writer.writerow(wine.model_dump())
+            recs_service.add_wine(wine)
+            search_service.add_wine(wine)
+            n = n + 1
+            if n == lines:
+                break
+
+    search_service.build_index()
+    recs_service.build_index()
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate wineinfo data")
@@ -27,38 +76,30 @@ if __name__ == "__main__":
         default="python_services/data/src/winemag-data-110k-v2.csv",
         help="The source file to read from",
     )
+    parser.add_argument(
+        "--version",
+        default=None,
+        help="Build into a versioned subdirectory of the data path and publish it "
+        "once complete, so running services hot reload it",
+    )
+    parser.add_argument(
+        "--artifact",
+        default=None,
+        help="Also package the built data into a checksummed artifact in this "
+        "directory, for services to install with DATA_ARTIFACT",
+    )
     args = parser.parse_args()
 
-    service_settings = ServiceSettings()
-    if not os.path.exists(service_settings.data_path):
-        os.mkdir(service_settings.data_path)
-
-    persist_service = PersistServiceImpl(service_settings, True)
-    catalog_service = CatalogServiceImpl(service_settings, True)
-    recs_service = RecsServiceImpl(service_settings, True)
-    search_service = SearchServiceImpl(service_settings, True)
-    search_service.open_index()
-    recs_service.open_index()
-    with open(catalog_service.file_name, "w", encoding="utf-8") as catalog_file:
-        csv_writer = csv.DictWriter(catalog_file, Wine.model_fields)
-        csv_writer.writeheader()
-        with open(args.src, "r", encoding="utf-8") as file:
-            reader = csv.DictReader(file)
-            n = 0
-            for row in reader:
-                row = {k: v if v is not None else "" for k, v in row.items()}
-                # clean up the
-                row["title"] = row["title"].removesuffix(" (" + row["region_1"] + ")")
-                row["title"] = row["title"].removesuffix(" (" + row["province"] + ")")
-                row["title"] = row["title"].strip()
-                wine = Wine.model_validate(row)
-                wine = catalog_service.add_wine(wine)
-                csv_writer.writerow(wine.model_dump())
-                recs_service.add_wine(wine)
-                search_service.add_wine(wine)
-                n = n + 1
-                if n == args.lines:
-                    break
+    root_settings = ServiceSettings()
+    service_settings = versioned_settings(root_settings, args.version)
+    if not args.version:
+        # user data isn't versioned. persist only ever serves from the data
+        # path itself, so an unversioned build starts it off empty
+        PersistServiceImpl(root_settings, True)
+    with open(args.src, "r", encoding="utf-8") as file:
+        build_data(service_settings, csv.DictReader(file), args.lines)
 
-    search_service.build_index()
-    recs_service.build_index()
+    if args.version:
+        publish_data_version(root_settings.data_path, args.version)
+    if args.artifact:
+        print(pack_artifact(service_settings.data_path, args.artifact))
@@ -0,0 +1,145 @@
+import os
+import sys
+
+sys.path.append(
+    os.path.abspath(
+        os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir)
+    )
+)
+from python_services.app.common.config import ServiceSettings
+from python_services.app.services.persist_service_impl import (
+    ShardLayoutError,
+    has_cellar_rows,
+    init_shard,
+    shard_for,
+    shard_paths,
+)
+import argparse
+import sqlite3
+from collections import defaultdict
+from contextlib import closing
+from typing import List
+
+RETIRED_SUFFIX = ".retired"
+
+
+def remove_journal(path: str):
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def count_rows(path: str) -> int:
+    with closing(sqlite3.connect(path)) as conn:
+        return conn.execute("SELECT COUNT(*) FROM cellar").fetchone()[0]
+
+
+def rebalance(
+    data_path: str, from_shards: int, to_shards: int, batch_size: int = 1000
+) -> List[int]:
+    """
+    Copy the cellars in data_path from from_shards shards into a new set of
+    to_shards shards, returning how many rows each new shard got. The old
+    shards are renamed with RETIRED_SUFFIX. Persist must not be running.
+    """
+    if from_shards == to_shards:
+        raise ShardLayoutError(f"the data is already in {to_shards} shards")
+    sources = shard_paths(data_path, from_shards)
+    targets = shard_paths(data_path, to_shards)
+    if missing := [path for path in sources if not os.path.exists(path)]:
+        raise ShardLayoutError(f"missing shards {', '.join(missing)}")
+    # an empty database, like the one build_data.py leaves, can be replaced
+    if in_use := [
+        path for path in targets if os.path.exists(path) and has_cellar_rows(path)
+    ]:
+        raise ShardLayoutError(f"{', '.join(in_use)} already hold cellar data")
+
+    # build the new shards beside where they go, so nothing is replaced
+    # until they're all complete
+    tmp_targets = [f"{path}.rebalance" for path in targets]
+    for shard, path in enumerate(tmp_targets):
+        if os.path.exists(path):
+            os.remove(path)
+        # persist gives the new shards a new layout when it starts on them
+        init_shard(path, None, shard, to_shards)
+
+    conns = [sqlite3.connect(path) for path in tmp_targets]
+    try:
+        for source in sources:
+            with closing(sqlite3.connect(source)) as source_conn:
+                # keeping each user's rows in their original order keeps
+                # their order in the rebuilt cellar logs too
+                cursor = source_conn.execute(
+                    "SELECT user_id, wine_id FROM cellar ORDER BY id"
+                )
+                while rows := cursor.fetchmany(batch_size):
+                    by_shard = defaultdict(list)
+                    for user_id, wine_id in rows:
+                        by_shard[shard_for(user_id, to_shards)].append(
+                            (user_id, wine_id)
+                        )
+                    for shard, shard_rows in by_shard.items():
+                        conns[shard].executemany(
+                            "INSERT INTO cellar (user_id, wine_id) VALUES (?, ?)",
+                            shard_rows,
+                        )
+        for conn in conns:
+            conn.commit()
+    finally:
+        for conn in conns:
+            conn.close()
+
+    expected = sum(count_rows(path) for path in sources)
+    counts = [count_rows(path) for path in tmp_targets]
+    if sum(counts) != expected:
+        raise ShardLayoutError(f"copied {sum(counts)} cellar rows, not {expected}")
+    for tmp_path, path in zip(tmp_targets, targets):
+        # the journal of an empty database being replaced mustn't be applied
+        # to the new one
+        remove_journal(path)
+        os.replace(tmp_path, path)
+    # move the old shards aside so persist can't be started on them by mistake
+    for path in sources:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.replace(path + suffix, path + RETIRED_SUFFIX + suffix)
+    return counts
+
+
+if __name__ == "__main__":
+    settings = ServiceSettings()
+    parser = argparse.ArgumentParser(
+        description="Move persist's data to a different number of shards. Stop "
+        "persist first, then restart it with PERSIST_SHARDS set to --to"
+    )
+    parser.add_argument(
+        "--data-path",
+        default=settings.data_path,
+        help="The data path persist serves from",
+    )
+    parser.add_argument(
+        "--from",
+        dest="from_shards",
+        default=settings.persist_shards,
+        type=int,
+        help="The number of shards the data is in now",
+    )
+    parser.add_argument(
+        "--to",
+        dest="to_shards",
+        required=True,
+        type=int,
+        help="The number of shards to move the data to",
+    )
+    parser.add_argument("--batch-size", default=1000, type=int)
+    args = parser.parse_args()
+
+    counts = rebalance(
+        args.data_path, args.from_shards, args.to_shards, args.batch_size
+    )
+    for path, count in zip(shard_paths(args.data_path, args.to_shards), counts):
+        print(f"{path}: {count} cellar rows")
+    print(
+        f"restart persist with PERSIST_SHARDS={args.to_shards}. the old shards "
+        f"were kept as *.db{RETIRED_SUFFIX} and can be deleted once it's running"
+    )